@@ -6,50 +6,217 @@ Checks if all requirements are met before running the simulation
 
 import os
 import sys
+import io
 import json
-
-def check_firebase_credentials():
+import time
+import mmap
+import socket
+import functools
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REQUIRED_CREDENTIAL_FIELDS = ['type', 'project_id', 'private_key', 'client_email']
+_REQUIRED = frozenset(REQUIRED_CREDENTIAL_FIELDS)
+
+CREDENTIALS_SCHEMA = {
+    "type": "object",
+    "required": REQUIRED_CREDENTIAL_FIELDS,
+    "properties": {field: {"type": "string"} for field in REQUIRED_CREDENTIAL_FIELDS},
+}
+
+# Build the validator once at import instead of on every validate() call
+try:
+    from jsonschema.validators import validator_for
+    _validator_cls = validator_for(CREDENTIALS_SCHEMA)
+    _validator_cls.check_schema(CREDENTIALS_SCHEMA)
+    _CRED_VALIDATOR = _validator_cls(CREDENTIALS_SCHEMA)
+except ImportError:
+    _CRED_VALIDATOR = None
+
+CREDENTIALS_PATH = "firebase_config/serviceAccountKey.json"
+SIMULATION_SCRIPT_PATH = "test_simulation_student.py"
+
+# Results of the checks, keyed by check name, for when this module is imported
+# and the checks are called repeatedly: {name: (key, expires_at, passed, output)}
+_check_cache = {}
+
+def invalidate_caches():
+    """Forget memoized check results (mirrors importlib.invalidate_caches)"""
+    _check_cache.clear()
+    importlib.invalidate_caches()
+
+def _credentials_cache_key():
+    try:
+        return CREDENTIALS_PATH, os.stat(CREDENTIALS_PATH).st_mtime_ns
+    except OSError:
+        return CREDENTIALS_PATH, None
+
+def _memoize_check(key_func=lambda: None, ttl=None):
+    """Cache a check's result and output until its key changes or ttl seconds pass"""
+    def decorator(check_func):
+        @functools.wraps(check_func)
+        def wrapper(out=None, **kwargs):
+            out = out if out is not None else sys.stdout
+            key = key_func()
+            cached = _check_cache.get(check_func.__name__)
+            if cached and cached[0] == key and (cached[1] is None or time.monotonic() < cached[1]):
+                out.write(cached[3])
+                return cached[2]
+
+            buffer = io.StringIO()
+            passed = check_func(buffer, **kwargs)
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            _check_cache[check_func.__name__] = (key, expires_at, passed, buffer.getvalue())
+            out.write(buffer.getvalue())
+            return passed
+        return wrapper
+    return decorator
+
+def _load_credential_fields(f):
+    """Read only the required top-level fields from an open credentials file.
+
+    Streams with ijson when available and stops as soon as every required
+    field has been seen; otherwise parses the whole file with orjson, or
+    json.load as a last resort.
+    """
+    if ijson is None:
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError
+        data = orjson.loads(f.read()) if orjson is not None else json.load(f)
+        if not isinstance(data, dict):
+            raise json.JSONDecodeError("Expected a JSON object", "", 0)
+        return {k: data[k] for k in _REQUIRED.intersection(data)}
+
+    fields = {}
+    try:
+        for key, value in ijson.kvitems(f, ''):
+            if key in _REQUIRED:
+                fields[key] = value
+                if len(fields) == len(_REQUIRED):
+                    break
+    except ijson.JSONError as e:
+        raise json.JSONDecodeError(str(e), "", 0)
+    return fields
+
+# Set by --fast: try the byte scanner below before doing a real JSON parse
+FAST_SCAN = False
+
+def _scan_credential_fields(path):
+    """Pull the required string fields out of the credentials file without parsing it.
+
+    Looks for each `"key":` token with bytes.find and decodes only that value.
+    This doesn't check nesting or overall syntax, so it returns None whenever a
+    field can't be found cleanly and the caller falls back to a full parse.
+    """
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            fields = {}
+            for field in REQUIRED_CREDENTIAL_FIELDS:
+                pos = buf.find(b'"' + field.encode() + b'"')
+                if pos == -1:
+                    return None
+                pos += len(field) + 2
+                while buf[pos:pos + 1] in (b' ', b'\t', b'\r', b'\n'):
+                    pos += 1
+                if buf[pos:pos + 1] != b':':
+                    return None
+                pos += 1
+                while buf[pos:pos + 1] in (b' ', b'\t', b'\r', b'\n'):
+                    pos += 1
+                if buf[pos:pos + 1] != b'"':
+                    return None
+                end = pos + 1
+                while True:
+                    end = buf.find(b'"', end)
+                    if end == -1:
+                        return None
+                    backslashes = 0
+                    while buf[end - 1 - backslashes] == 0x5c:
+                        backslashes += 1
+                    if backslashes % 2 == 0:
+                        break
+                    end += 1
+                fields[field] = json.loads(buf[pos:end + 1])
+            return fields
+    except (ValueError, OSError):
+        # Empty files can't be mmapped; let the full parse report the problem
+        return None
+
+def _scan_dirs(*dirs):
+    """Map relative paths to DirEntry objects with one scandir per directory"""
+    entries = {}
+    for d in dirs:
+        try:
+            with os.scandir(d) as it:
+                for entry in it:
+                    entries[entry.name if d == "." else f"{d}/{entry.name}"] = entry
+        except FileNotFoundError:
+            pass
+    return entries
+
+@_memoize_check(key_func=_credentials_cache_key)
+def check_firebase_credentials(out, entries=None):
     """Check if Firebase service account key exists and is valid"""
-    cred_path = "firebase_config/serviceAccountKey.json"
+    cred_path = CREDENTIALS_PATH
 
-    print("1️⃣  Checking Firebase credentials...")
-
-    if not os.path.exists(cred_path):
-        print(f"   ❌ File not found: {cred_path}")
-        print(f"   📝 Please add your serviceAccountKey.json file")
-        print(f"   📚 See SIMULATION_SETUP.md for instructions")
-        return False
+    print("1️⃣  Checking Firebase credentials...", file=out)
 
     try:
-        with open(cred_path, 'r') as f:
-            data = json.load(f)
-
-        required_fields = ['type', 'project_id', 'private_key', 'client_email']
-        missing = [field for field in required_fields if field not in data]
-
-        if missing:
-            print(f"   ❌ Invalid credentials file - missing fields: {missing}")
-            return False
+        if entries is not None and cred_path not in entries:
+            raise FileNotFoundError(cred_path)
+
+        data = _scan_credential_fields(cred_path) if FAST_SCAN else None
+        if data is None:
+            # open() already stats the file, so no separate exists() probe
+            with open(cred_path, 'rb') as f:
+                data = _load_credential_fields(f)
+
+        if _CRED_VALIDATOR is not None:
+            if not _CRED_VALIDATOR.is_valid(data):
+                errors = [e.message for e in _CRED_VALIDATOR.iter_errors(data)]
+                print(f"   ❌ Invalid credentials file: {'; '.join(errors)}", file=out)
+                return False
+        else:
+            missing = sorted(_REQUIRED.difference(data))
+
+            if missing:
+                print(f"   ❌ Invalid credentials file - missing fields: {missing}", file=out)
+                return False
 
         if data.get('project_id') == 'your-project-id':
-            print(f"   ⚠️  Credentials file contains example values")
-            print(f"   📝 Please use your actual Firebase credentials")
+            print(f"   ⚠️  Credentials file contains example values", file=out)
+            print(f"   📝 Please use your actual Firebase credentials", file=out)
             return False
 
-        print(f"   ✅ Credentials file found and valid")
-        print(f"   📦 Project ID: {data.get('project_id')}")
+        print(f"   ✅ Credentials file found and valid", file=out)
+        print(f"   📦 Project ID: {data.get('project_id')}", file=out)
         return True
 
+    except FileNotFoundError:
+        print(f"   ❌ File not found: {cred_path}", file=out)
+        print(f"   📝 Please add your serviceAccountKey.json file", file=out)
+        print(f"   📚 See SIMULATION_SETUP.md for instructions", file=out)
+        return False
     except json.JSONDecodeError:
-        print(f"   ❌ Invalid JSON in credentials file")
+        print(f"   ❌ Invalid JSON in credentials file", file=out)
         return False
     except Exception as e:
-        print(f"   ❌ Error reading credentials: {e}")
+        print(f"   ❌ Error reading credentials: {e}", file=out)
         return False
 
-def check_dependencies():
+@_memoize_check()
+def check_dependencies(out):
     """Check if required Python packages are installed"""
-    print("\n2️⃣  Checking Python dependencies...")
+    print("\n2️⃣  Checking Python dependencies...", file=out)
 
     required_packages = [
         ('requests', 'requests'),
@@ -60,97 +227,142 @@ def check_dependencies():
 
     missing = []
 
+    # find_spec only locates the package; it doesn't execute it (firebase_admin
+    # pulls in grpc/google.auth on import, which is slow just to test presence).
+    # Packages already imported by the host process skip the finder entirely.
     for package_import, package_name in required_packages:
-        try:
-            __import__(package_import)
-        except ImportError:
+        if package_import in sys.modules:
+            continue
+        if importlib.util.find_spec(package_import) is None:
             missing.append(package_name)
 
     if missing:
-        print(f"   ❌ Missing packages: {', '.join(missing)}")
-        print(f"   📝 Install with: pip install -r requirements.txt")
+        print(f"   ❌ Missing packages: {', '.join(missing)}", file=out)
+        print(f"   📝 Install with: pip install -r requirements.txt", file=out)
         return False
 
-    print(f"   ✅ All required packages installed")
+    print(f"   ✅ All required packages installed", file=out)
     return True
 
-def check_backend_connectivity():
+@_memoize_check(ttl=1.0)
+def check_backend_connectivity(out):
     """Check if backend server is running"""
-    print("\n3️⃣  Checking backend server...")
+    print("\n3️⃣  Checking backend server...", file=out)
 
+    # A bare TCP connect is enough to know something is listening; no need to
+    # import requests or make the server render /docs
     try:
-        import requests
-        response = requests.get("http://127.0.0.1:8000/docs", timeout=2)
-        print(f"   ✅ Backend is running (Status: {response.status_code})")
+        with socket.create_connection(("127.0.0.1", 8000), timeout=2):
+            pass
+        print(f"   ✅ Backend is running (port 8000)", file=out)
         return True
-    except requests.exceptions.ConnectionError:
-        print(f"   ❌ Backend not running")
-        print(f"   📝 Start with: python3 main.py")
+    except ConnectionRefusedError:
+        print(f"   ❌ Backend not running", file=out)
+        print(f"   📝 Start with: python3 main.py", file=out)
         return False
-    except Exception as e:
-        print(f"   ⚠️  Cannot connect to backend: {e}")
+    except OSError as e:
+        print(f"   ⚠️  Cannot connect to backend: {e}", file=out)
         return False
 
-def check_simulation_script():
+def check_simulation_script(out=None, entries=None):
     """Check if simulation script exists"""
-    print("\n4️⃣  Checking simulation script...")
+    out = out if out is not None else sys.stdout
+    print("\n4️⃣  Checking simulation script...", file=out)
 
-    script_path = "test_simulation_student.py"
+    script_path = SIMULATION_SCRIPT_PATH
 
-    if not os.path.exists(script_path):
-        print(f"   ❌ Simulation script not found: {script_path}")
+    try:
+        if entries is None:
+            st = os.stat(script_path)
+        elif script_path in entries:
+            st = entries[script_path].stat()
+        else:
+            raise FileNotFoundError(script_path)
+    except FileNotFoundError:
+        print(f"   ❌ Simulation script not found: {script_path}", file=out)
         return False
 
-    if not os.access(script_path, os.X_OK):
-        print(f"   ⚠️  Script not executable, making it executable...")
-        os.chmod(script_path, 0o755)
+    if not st.st_mode & 0o111:
+        print(f"   ❌ Script not executable", file=out)
+        print(f"   📝 Fix with: chmod +x {script_path}", file=out)
+        return False
 
-    print(f"   ✅ Simulation script ready")
+    print(f"   ✅ Simulation script ready", file=out)
     return True
 
-def main():
-    print("=" * 60)
-    print("🔍 Test Simulation Setup Verification")
-    print("=" * 60)
-    print()
+def _run_check(name, check_func, deps, dep_futures, out):
+    """Run a check once its dependencies finish; None means it was skipped"""
+    if not all(future.result() for future in dep_futures):
+        print(f"\n⏭️  Skipping {name} check (requires: {', '.join(deps)})", file=out)
+        return None
+    return check_func(out)
 
+def main():
+    # Build the whole report in memory and write it out once at the end
+    report = io.StringIO()
+    print("=" * 60, file=report)
+    print("🔍 Test Simulation Setup Verification", file=report)
+    print("=" * 60, file=report)
+    print(file=report)
+
+    # One directory listing each for the files the checks look for, instead of
+    # a separate existence probe per file
+    entries = _scan_dirs(".", os.path.dirname(CREDENTIALS_PATH))
+
+    # (name, check, names of checks that must pass first), in dependency order
     checks = [
-        ("Firebase Credentials", check_firebase_credentials),
-        ("Python Dependencies", check_dependencies),
-        ("Backend Server", check_backend_connectivity),
-        ("Simulation Script", check_simulation_script)
+        ("Firebase Credentials", functools.partial(check_firebase_credentials, entries=entries), ()),
+        ("Python Dependencies", check_dependencies, ()),
+        ("Backend Server", check_backend_connectivity, ("Python Dependencies",)),
+        ("Simulation Script", functools.partial(check_simulation_script, entries=entries), ("Firebase Credentials",))
     ]
 
-    results = {}
-    for name, check_func in checks:
-        results[name] = check_func()
-
-    print("\n" + "=" * 60)
-    print("📊 Summary")
-    print("=" * 60)
+    # The checks mostly wait on I/O (the backend probe can take the full 2 s
+    # timeout), so run them concurrently. A check whose dependencies failed is
+    # skipped rather than run. Each one writes to its own buffer so the report
+    # still prints in order.
+    buffers = {name: io.StringIO() for name, _, _ in checks}
+    futures = {}
+    with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+        for name, check_func, deps in checks:
+            dep_futures = [futures[dep] for dep in deps]
+            futures[name] = executor.submit(_run_check, name, check_func, deps, dep_futures, buffers[name])
+        results = {name: future.result() for name, future in futures.items()}
+
+    for name, _, _ in checks:
+        report.write(buffers[name].getvalue())
+
+    print("\n" + "=" * 60, file=report)
+    print("📊 Summary", file=report)
+    print("=" * 60, file=report)
 
     all_passed = all(results.values())
 
     for name, passed in results.items():
-        status = "✅" if passed else "❌"
-        print(f"{status} {name}")
+        if passed is None:
+            print(f"⏭️  {name} (skipped)", file=report)
+        else:
+            status = "✅" if passed else "❌"
+            print(f"{status} {name}", file=report)
 
-    print()
+    print(file=report)
 
     if all_passed:
-        print("🎉 All checks passed! You're ready to run the simulation.")
-        print()
-        print("Run the simulation with:")
-        print("   python3 test_simulation_student.py")
-        print()
-        print("Or with custom number of sessions:")
-        print("   python3 test_simulation_student.py 5")
-        return 0
+        print("🎉 All checks passed! You're ready to run the simulation.", file=report)
+        print(file=report)
+        print("Run the simulation with:", file=report)
+        print("   python3 test_simulation_student.py", file=report)
+        print(file=report)
+        print("Or with custom number of sessions:", file=report)
+        print("   python3 test_simulation_student.py 5", file=report)
     else:
-        print("⚠️  Some checks failed. Please fix the issues above.")
-        print()
-        print("📚 See SIMULATION_SETUP.md for detailed instructions")
-        return 1
+        print("⚠️  Some checks failed. Please fix the issues above.", file=report)
+        print(file=report)
+        print("📚 See SIMULATION_SETUP.md for detailed instructions", file=report)
+
+    sys.stdout.write(report.getvalue())
+    return 0 if all_passed else 1
 
 if __name__ == "__main__":
+    FAST_SCAN = "--fast" in sys.argv[1:]
     sys.exit(main())
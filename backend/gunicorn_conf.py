@@ -0,0 +1,61 @@
+"""Gunicorn settings for running the API with Uvicorn workers.
+
+Usage: gunicorn main:app -c gunicorn_conf.py
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '7860')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Uvicorn picks up uvloop and httptools automatically when they're installed
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import main.py once in the master and fork, so the workers share those pages.
+# Firebase is initialized per worker in the app's lifespan hook since its gRPC
+# channels can't be shared across a fork.
+preload_app = True
+
+# Groq calls on the quest endpoints can take a while
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+# Torch sizes its intra-op thread pool to every core in each process; split the
+# cores between the workers instead so they don't oversubscribe the CPU
+_torch_threads = int(os.getenv("TORCH_THREADS", max(1, multiprocessing.cpu_count() // workers)))
+
+
+def _cuda_available():
+    # The NVML-based check answers without initialising CUDA in the master,
+    # which would leave every forked worker unable to use it
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
+def when_ready(server):
+    """Load the CodeBERT weights in the master before any worker is forked.
+    Workers then inherit the loaded model and the lifespan hook skips it.
+    A CUDA context can't cross a fork, so on a GPU host each worker loads
+    its own copy onto the device instead.
+    """
+    import gc
+    import main
+    if not _cuda_available():
+        main._load_ai_model()
+    # Park everything loaded so far in the collector's permanent generation.
+    # Otherwise each worker's first full collection writes to the GC header of
+    # every inherited object, copying those shared pages into private memory.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """Cap this worker's torch intra-op threads at its share of the cores."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(_torch_threads)
@@ -1,40 +1,219 @@
 import firebase_admin
-from firebase_admin import credentials, firestore
-from fastapi import FastAPI, HTTPException
+from firebase_admin import credentials, firestore, firestore_async
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
 from google.cloud.firestore_v1.base_query import FieldFilter
-from typing import Optional, List, Union
+from google.api_core.exceptions import Aborted, FailedPrecondition, NotFound
+from cachetools import LRUCache, TTLCache
+from typing import Annotated, Any, Optional, List, Union
+from contextlib import asynccontextmanager
 import os
-import joblib
+import logging
+import logging.handlers
+import queue
+import anyio
+import asyncio
+import threading
+import time
 import random
 import uuid
 import json
-import math
+import gzip
+import hashlib
+import datetime
+import orjson
 import statistics
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-
-if not firebase_admin._apps:
-    cred_json_env = os.getenv("FIREBASE_CREDENTIALS_JSON")
-    if cred_json_env:
-        cred = credentials.Certificate(json.loads(cred_json_env))
-        firebase_admin.initialize_app(cred)
-        print("Firebase Admin Connected (env)")
-    else:
-        cred_path = os.getenv("FIREBASE_CREDS_PATH", "firebase_config/serviceAccountKey.json")
-        if os.path.exists(cred_path):
-            cred = credentials.Certificate(cred_path)
+
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s",
+)
+logger = logging.getLogger("devskill")
+_log_listener = None
+
+
+def _start_log_listener():
+    """Route devskill records through a queue so a background thread writes them.
+
+    Started per worker in the lifespan: the thread would not survive Gunicorn's
+    fork of a preloaded app. Until then records go straight to the root handlers.
+    """
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(
+        log_queue, *logging.getLogger().handlers, respect_handler_level=True
+    )
+    _log_listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.propagate = False
+
+
+def _stop_log_listener():
+    global _log_listener
+    if _log_listener is None:
+        return
+    for handler in [h for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        logger.removeHandler(handler)
+    logger.propagate = True
+    _log_listener.stop()  # writes out whatever is still queued
+    _log_listener = None
+
+db = None
+# Collection references used on every request, built once with the client
+sessions_col = None
+quests_col = None
+users_col = None
+
+def _init_firebase():
+    """Initialize Firebase Admin and the Firestore client.
+    Runs per worker at startup (not at import) because gRPC channels
+    don't survive the fork when Gunicorn preloads the app.
+    """
+    global db, sessions_col, quests_col, users_col
+    if not firebase_admin._apps:
+        cred_json_env = os.getenv("FIREBASE_CREDENTIALS_JSON")
+        if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
+            # google-auth resolves and caches the credential itself
+            firebase_admin.initialize_app(credentials.ApplicationDefault())
+            logger.info("Firebase Admin Connected (application default credentials)")
+        elif cred_json_env:
+            cred = credentials.Certificate(json.loads(cred_json_env))
             firebase_admin.initialize_app(cred)
-            print(f"Firebase Admin Connected (file: {cred_path})")
+            logger.info("Firebase Admin Connected (env)")
         else:
-            raise RuntimeError(
-                f"Firebase credentials not found. Set FIREBASE_CREDENTIALS_JSON env var "
-                f"or place serviceAccountKey.json at {cred_path}"
-            )
-
-db = firestore.client()
-app = FastAPI(title="DevSkill Tracker API", version="1.0.0")
+            cred_path = os.getenv("FIREBASE_CREDS_PATH", "firebase_config/serviceAccountKey.json")
+            if os.path.exists(cred_path):
+                cred = credentials.Certificate(cred_path)
+                firebase_admin.initialize_app(cred)
+                logger.info("Firebase Admin Connected (file: %s)", cred_path)
+            else:
+                raise RuntimeError(
+                    f"Firebase credentials not found. Set GOOGLE_APPLICATION_CREDENTIALS or "
+                    f"FIREBASE_CREDENTIALS_JSON env var, or place serviceAccountKey.json at {cred_path}"
+                )
+
+    # AsyncClient so Firestore calls in the async endpoints don't block the event loop.
+    # It and the sync client used by the quest listener both reuse the app's credential.
+    db = firestore_async.client()
+    sessions_col = db.collection("sessions")
+    quests_col = db.collection("quests")
+    users_col = db.collection("users")
+
+# Firestore allows at most 500 writes per batch commit. Bulk writes are split
+# into smaller minibatches committed in parallel, which contend less and
+# sustain far higher write throughput than one large commit at a time.
+FIRESTORE_BATCH_LIMIT = 500
+FIRESTORE_MINIBATCH_SIZE = 40
+FIRESTORE_COMMIT_CONCURRENCY = 10
+FIRESTORE_COMMIT_RETRIES = 5
+
+async def _commit_minibatch(ops: list, semaphore: asyncio.Semaphore):
+    """Commit one minibatch, retrying with exponential backoff on contention."""
+    async with semaphore:
+        for attempt in range(FIRESTORE_COMMIT_RETRIES):
+            batch = db.batch()
+            for doc_ref, data, op in ops:
+                if op == "delete":
+                    batch.delete(doc_ref)
+                else:
+                    getattr(batch, op)(doc_ref, data)
+            try:
+                await batch.commit()
+                return
+            except Aborted:
+                if attempt == FIRESTORE_COMMIT_RETRIES - 1:
+                    raise
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+async def _commit_batched(ops: list, batch_size: int = FIRESTORE_MINIBATCH_SIZE):
+    """Commit writes in WriteBatch chunks instead of one RPC per document.
+    ops is a list of (doc_ref, data, op) with op one of "set", "update", "delete"
+    (data is ignored for deletes). Chunks of batch_size (capped at 500) are
+    committed concurrently, at most FIRESTORE_COMMIT_CONCURRENCY at a time.
+    """
+    batch_size = min(batch_size, FIRESTORE_BATCH_LIMIT)
+    semaphore = asyncio.Semaphore(FIRESTORE_COMMIT_CONCURRENCY)
+    await asyncio.gather(*(
+        _commit_minibatch(ops[start:start + batch_size], semaphore)
+        for start in range(0, len(ops), batch_size)
+    ))
+
+# Short-lived per-process caches for idempotent Firestore reads on hot paths
+FIRESTORE_CACHE_TTL = 30
+_user_id_cache = TTLCache(maxsize=4096, ttl=FIRESTORE_CACHE_TTL)      # email -> userId
+_quest_query_cache = TTLCache(maxsize=1024, ttl=FIRESTORE_CACHE_TTL)  # (language, level) -> quests
+_language_cache = TTLCache(maxsize=4096, ttl=FIRESTORE_CACHE_TTL)     # userId -> /detect-language result
+_missing_quest_ids = TTLCache(maxsize=4096, ttl=FIRESTORE_CACHE_TTL)  # quest ids with no document
+
+# Whether the sessions (userId, timestamp desc) composite index exists; cleared
+# by the startup check or by the first query that finds it missing, so later
+# requests go straight to the fallback instead of failing a query first
+_sessions_index_ready = True
+
+async def _check_firestore_indexes():
+    """Warn at startup when a composite index from firestore.indexes.json is missing.
+
+    Firestore only reports a missing index when the query runs, and the queries
+    that need one fall back to slower unindexed reads, so nothing else shows it.
+    """
+    probe = sessions_col.where(
+        filter=FieldFilter("userId", "==", "__index_probe__")
+    ).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(1)
+    try:
+        [doc async for doc in probe.stream()]
+    except FailedPrecondition as e:
+        global _sessions_index_ready
+        _sessions_index_ready = False
+        logger.warning("Firestore index missing, deploy firestore.indexes.json: %s", e)
+    except Exception as e:
+        logger.warning("Firestore index check skipped: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sync Firestore/Groq work runs on anyio's thread pool, which defaults to
+    # 40 threads and stalls every such call once they're all busy
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 200
+    global _quest_watch, _quest_loop, _model_load_task
+    _start_log_listener()
+    # uvicorn silently falls back to the stdlib loop when uvloop can't be
+    # imported, so record which one this worker actually got
+    logger.info("Event loop: %s", type(asyncio.get_running_loop()).__module__.split(".")[0])
+    _init_firebase()
+    await _check_firestore_indexes()
+    # Keep the quest lookup in sync with writes from every worker via a listener
+    # rather than re-reading the collection. Watch is only on the sync client.
+    _quest_loop = asyncio.get_running_loop()
+    try:
+        _quest_watch = firestore.client().collection("quests").on_snapshot(_on_quests_snapshot)
+    except Exception as e:
+        logger.warning("Quest listener not started, falling back to periodic reads: %s", e)
+    # The listener's first snapshot is the whole collection, so wait for it
+    # rather than reading every quest a second time; read directly only if
+    # the listener isn't running or is slow to deliver
+    if _quest_watch is None or not await anyio.to_thread.run_sync(
+        _quest_snapshot_ready.wait, QUEST_SNAPSHOT_WAIT
+    ):
+        await _rebuild_quest_lookup()
+    # Model loading is slow and blocking; keep it off the event loop and don't
+    # hold up startup for it. Requests that need the model wait in _loaded_model.
+    _model_load_task = asyncio.create_task(anyio.to_thread.run_sync(_load_ai_model))
+    yield
+    if _quest_watch is not None:
+        _quest_watch.unsubscribe()
+        _quest_watch = None
+    _shutdown_sandbox_pool()
+    model_batcher.stop()
+    _stop_log_listener()
+
+app = FastAPI(
+    title="DevSkill Tracker API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Enable CORS for frontend and extension
 _extra_origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
@@ -45,14 +224,29 @@ _default_origins = [
     "http://127.0.0.1:5173",
     "https://fyp-ten-gray.vercel.app",
 ]
+# Explicit methods/headers instead of "*": neither client sends cookies, so
+# credentials aren't needed, and Starlette can answer preflights from the fixed
+# lists instead of echoing back whatever the browser asked for
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=_default_origins + _extra_origins,
+    # CORS_ORIGINS often repeats the production URL; each origin is checked once
+    allow_origins=list(dict.fromkeys(_default_origins + _extra_origins)),
     allow_origin_regex=r"vscode-webview://.*",
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_credentials=False,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "HEAD"],
+    allow_headers=["Content-Type", "Authorization"],
+    # The extension PUTs session updates on a timer; let browsers reuse a
+    # preflight for a day (they cap it lower) instead of Starlette's 10 minutes
+    max_age=86400,
 )
+# Compress larger JSON bodies (quest lists, session history); responses that
+# already carry a Content-Encoding are passed through untouched
+GZIP_MIN_SIZE = 1024
+# Per-response compression runs on every request, where level 9 costs several
+# times the CPU of level 5 for a few percent smaller JSON. Blobs compressed once
+# per rebuild (the quest languages) still use gzip's default of 9.
+GZIP_COMPRESS_LEVEL = 5
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
 
 # --- AI Model Loading (CodeBERT) ---
 CODEBERT_LABEL2ID = {"Beginner": 0, "Intermediate": 1, "Advanced": 2}
@@ -63,224 +257,623 @@ class CodeBERTClassifier:
     """Thin wrapper around a fine-tuned CodeBERT model with sklearn-compatible API."""
 
     def __init__(self, model_dir: str):
+        # torch/transformers take seconds to import, so they are only pulled in
+        # once a model is actually being loaded
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_dir).to(self.device)
+        # low_cpu_mem_usage loads weights straight from the (mmapped) checkpoint
+        # instead of random-initialising the model and copying over it
+        self.model = AutoModelForSequenceClassification.from_pretrained(
+            model_dir, low_cpu_mem_usage=True
+        ).to(self.device)
         self.model.eval()
-        print(f"CodeBERT model loaded from '{model_dir}' on {self.device}")
+        # Gunicorn workers share these weight pages with the master copy-on-write
+        # (see gunicorn_conf.py); inference must never write to them
+        self.model.requires_grad_(False)
+        logger.info("CodeBERT model loaded from '%s' on %s", model_dir, self.device)
 
-    def _encode(self, code: str):
+    def _encode(self, codes: list):
         enc = self.tokenizer(
-            code,
+            codes,
             max_length=CODEBERT_MAX_LEN,
-            padding="max_length",
+            padding=True,
             truncation=True,
             return_tensors="pt"
         )
         return enc["input_ids"].to(self.device), enc["attention_mask"].to(self.device)
 
-    def predict(self, codes: list) -> list:
-        results = []
+    def _logits(self, codes: list):
+        import torch
+        # One forward pass over the whole batch instead of one per snippet
         with torch.no_grad():
-            for code in codes:
-                ids, mask = self._encode(code)
-                logits = self.model(input_ids=ids, attention_mask=mask).logits
-                label_id = int(torch.argmax(logits, dim=-1).item())
-                results.append(CODEBERT_ID2LABEL[label_id])
-        return results
+            ids, mask = self._encode(codes)
+            return self.model(input_ids=ids, attention_mask=mask).logits
+
+    def predict(self, codes: list) -> list:
+        if not codes:
+            return []
+        label_ids = self._logits(codes).argmax(dim=-1).cpu().tolist()
+        return [CODEBERT_ID2LABEL[label_id] for label_id in label_ids]
 
     def predict_proba(self, codes: list) -> list:
-        results = []
-        with torch.no_grad():
-            for code in codes:
-                ids, mask = self._encode(code)
-                logits = self.model(input_ids=ids, attention_mask=mask).logits
-                probs = torch.softmax(logits, dim=-1).squeeze(0).cpu().tolist()
-                results.append(probs)
-        return results
+        if not codes:
+            return []
+        return self._logits(codes).softmax(dim=-1).cpu().tolist()
+
+    def classify(self, codes: list) -> list:
+        """(label, confidence %) per snippet; the top class is picked by one
+        tensor reduction over the batch rather than per row in Python."""
+        if not codes:
+            return []
+        top, label_ids = self._logits(codes).softmax(dim=-1).max(dim=-1)
+        return [
+            (CODEBERT_ID2LABEL[label_id], p * 100.0)
+            for p, label_id in zip(top.cpu().tolist(), label_ids.cpu().tolist())
+        ]
+
+
+def _label_from_probs(probs: list) -> tuple:
+    """(label, confidence %) for one row of predict_proba output."""
+    # Builtin max/index run in C; no per-element key callback
+    top = max(probs)
+    return CODEBERT_ID2LABEL[probs.index(top)], top * 100.0
+
+async def _run_model(method, codes: list) -> list:
+    """Run a CodeBERT inference method on a worker thread.
+    Inference is CPU-bound and would otherwise stall the event loop; torch
+    releases the GIL inside its kernels, so the work still spreads across cores.
+    """
+    return await anyio.to_thread.run_sync(method, codes)
+
+# Concurrent single-snippet predictions are coalesced into one forward pass:
+# the first request waits up to MODEL_BATCH_WAIT seconds for others to join,
+# up to MODEL_BATCH_MAX snippets per batch
+MODEL_BATCH_MAX = 32
+MODEL_BATCH_WAIT = 0.010
+# Inference is deterministic, and the same code comes back through /analyze
+# and session end; recent results are reused instead of queued again
+MODEL_CACHE_SIZE = 1024
+
+def _code_digest(code: str) -> bytes:
+    return hashlib.blake2b(code.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+class ModelBatcher:
+    """Micro-batching front end for ai_model.predict_proba."""
+
+    def __init__(self):
+        self._queue = None
+        self._worker = None
+        self._results = LRUCache(maxsize=MODEL_CACHE_SIZE)  # code digest -> probs
+
+    async def predict_proba(self, code: str) -> list:
+        """Class probabilities for one snippet, computed as part of a batch."""
+        key = _code_digest(code)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+        if self._worker is None or self._worker.done():
+            # Started on first use so the queue belongs to the running loop
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((code, future))
+        probs = await future
+        self._results[key] = probs
+        return probs
+
+    def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + MODEL_BATCH_WAIT
+            while len(batch) < MODEL_BATCH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip callers that have gone away (client disconnected)
+            batch = [(code, future) for code, future in batch if not future.done()]
+            if not batch:
+                continue
+            # Identical snippets in one window (double submits, retries) share a row
+            codes = list(dict.fromkeys(code for code, _ in batch))
+            try:
+                all_probs = await _run_model(ai_model.predict_proba, codes)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            probs_by_code = dict(zip(codes, all_probs))
+            for code, future in batch:
+                if not future.done():
+                    future.set_result(probs_by_code[code])
 
+model_batcher = ModelBatcher()
 
 ai_model = None
-_local_model = "ai_models/best_codebert_large"
-_hub_model   = "Hannan-12/devskill-codebert"
-_model_src   = _local_model if os.path.isdir(_local_model) else _hub_model
-try:
-    ai_model = CodeBERTClassifier(_model_src)
-except Exception as _ex:
-    print(f"Warning: CodeBERT load failed from '{_model_src}': {_ex}")
+# Background load started by the lifespan; finishes at once when the Gunicorn
+# master already loaded the model before forking
+_model_load_task = None
+# Resolved against this file, not the working directory the server was started from
+_local_model = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ai_models", "best_codebert_large")
+_hub_model   = os.getenv("CODEBERT_MODEL_ID", "Hannan-12/devskill-codebert")
+
+def _load_ai_model():
+    """Load CodeBERT into ai_model (no-op if already loaded).
+    Called from the lifespan hook, or from the Gunicorn master before
+    forking so workers share the weights (see gunicorn_conf.py).
+    """
+    global ai_model
+    if ai_model is not None:
+        return
+    # A checkout can have the (gitignored) folder without the weights in it
+    has_local = os.path.isfile(os.path.join(_local_model, "config.json"))
+    model_src = _local_model if has_local else _hub_model
+    try:
+        ai_model = CodeBERTClassifier(model_src)
+    except Exception as ex:
+        logger.warning("CodeBERT load failed from '%s': %s", model_src, ex)
 
-if ai_model is None:
-    print("Warning: No AI model found — keyword fallback will be used.")
+    if ai_model is None:
+        logger.warning("No AI model found — keyword fallback will be used.")
+
+async def _loaded_model():
+    """ai_model, once the lifespan's background load has finished."""
+    if _model_load_task is not None and not _model_load_task.done():
+        # Shielded so one cancelled request doesn't cancel the load for all
+        await asyncio.shield(_model_load_task)
+    return ai_model
 
 
 # --- Quest lookup (populated from Firestore at runtime) ---
 ALL_QUESTS = {}
+# (language, level) -> tuple of quests, rebuilt together with ALL_QUESTS
+QUESTS_BY_LANGUAGE_LEVEL = {}
+# The same quests pre-serialized as (json bytes, AI-generated?) pairs, so
+# /get-quest(s) can answer from the index without encoding on every request
+QUEST_JSON_BY_LANGUAGE_LEVEL = {}
+# Other workers may have added quests since the last rebuild, so without a live
+# listener the index is only trusted for this long before falling back to a
+# Firestore query
+QUEST_INDEX_MAX_AGE = 300
+_quest_index_built_at = 0.0
+# Snapshot listener on the quests collection that keeps the lookup current
+_quest_watch = None
+# The worker's event loop, which the listener hands each rebuilt lookup to
+_quest_loop = None
+# Set once the listener has applied its first (full) snapshot
+_quest_snapshot_ready = threading.Event()
+QUEST_SNAPSHOT_WAIT = 10.0
+# /get-quest-languages response, serialized once per rebuild
+_quest_languages_blob = b""
+# gzip-compressed copy of the blob (empty when it is below GZIP_MIN_SIZE)
+_quest_languages_blob_gz = b""
+_quest_languages_etag = ""
+# quest id -> (pattern scanner, validators, sandbox specs) from _compile_validators,
+# kept alongside ALL_QUESTS so validation never has to touch the quest dicts
+QUEST_VALIDATORS = {}
+# (quest id, blake2b of the code) -> validate_solution result; cleared whenever
+# the validators are rebuilt
+VALIDATION_CACHE_SIZE = int(os.getenv("VALIDATION_CACHE_SIZE", "4096"))
+# validate_solution only reports this many failure messages
+MAX_FAILURE_DETAILS = 3
+_validation_cache = LRUCache(maxsize=VALIDATION_CACHE_SIZE)
 
 
 # --- Solution Validator ---
-import io
 import sys
 import re
+import functools
+import multiprocessing
+import concurrent.futures
+import sandbox
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None  # fall back to the regex scanner below
+
+@functools.lru_cache(maxsize=4096)
+def _compile_matcher(patterns: tuple):
+    """Compile a test case's literal patterns into one regex alternation.
+    The lookahead makes matches zero-width, so finditer reports a pattern at
+    every position where one starts (longest first when several do).
+    Cached per pattern list, so quests sharing patterns share the regex.
+    """
+    if not patterns:
+        return None
+    alternation = "|".join(re.escape(p) for p in sorted(set(patterns), key=len, reverse=True))
+    return re.compile(f"(?=({alternation}))")
+
+def _compile_scanner(patterns):
+    """Build a function returning the set of patterns that occur in some code.
+    All of a quest's literal patterns are found in a single pass over the
+    submission, so each test case becomes set lookups instead of substring scans.
+    """
+    literals = frozenset(patterns)
+    words = tuple(p for p in literals if p)
+    always = literals.difference(words)  # "" occurs in any code
+    if not words:
+        return lambda code: always
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for word in words:
+            automaton.add_word(word, word)
+        automaton.make_automaton()
+        def scan(code):
+            # iter() reports every occurrence, and common tokens ("for",
+            # "return") recur all through a submission; once each pattern has
+            # been seen the rest of the code can't change the result
+            found = set(always)
+            for _, word in automaton.iter(code):
+                found.add(word)
+                if len(found) == len(literals):
+                    break
+            return found
+        return scan
+
+    # The regex only reports the longest pattern starting at each position; any
+    # shorter pattern matching there is a prefix of it, so add those back
+    matcher = _compile_matcher(words)
+    prefixes = {p: frozenset(q for q in words if p.startswith(q)) for p in words}
+    def scan(code):
+        found = set(always)
+        for m in matcher.finditer(code):
+            found |= prefixes[m.group(1)]
+            if len(found) == len(literals):
+                break
+        return found
+    return scan
+
+# Submitted code runs in separate worker processes (see sandbox.py) so it can't
+# block the event loop, touch this process's state or take the server down
+SANDBOX_WORKERS = int(os.getenv("SANDBOX_WORKERS", "2"))
+SANDBOX_TIMEOUT = 5.0
+_sandbox_pool = None
+# One submission per worker at a time, so SANDBOX_TIMEOUT covers only running
+# the code and never time spent queued behind other submissions
+_sandbox_slots = asyncio.Semaphore(SANDBOX_WORKERS)
+
+def _get_sandbox_pool():
+    """Create the sandbox pool on first use, so each Gunicorn worker gets its own."""
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        _sandbox_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=SANDBOX_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=sandbox.init_worker,
+        )
+    return _sandbox_pool
+
+def _shutdown_sandbox_pool(kill: bool = False):
+    global _sandbox_pool
+    pool, _sandbox_pool = _sandbox_pool, None
+    if pool is None:
+        return
+    if kill:
+        # A runaway submission never returns on its own
+        for proc in list((pool._processes or {}).values()):
+            proc.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def _run_in_sandbox(code: str, specs: tuple) -> tuple:
+    """Run a submission's executed test cases in the sandbox pool.
+    Returns (results, completed); completed is False when the run itself failed
+    (timeout, killed worker) and every result is that error.
+    """
+    async with _sandbox_slots:
+        for attempt in range(2):
+            pool = _get_sandbox_pool()
+            try:
+                future = pool.submit(sandbox.run_tests, code, list(specs))
+                return await asyncio.wait_for(asyncio.wrap_future(future), SANDBOX_TIMEOUT), True
+            except asyncio.TimeoutError:
+                _shutdown_sandbox_pool(kill=True)
+                error = "Execution error: timed out"
+            except (concurrent.futures.process.BrokenProcessPool, asyncio.CancelledError):
+                if asyncio.current_task().cancelling():
+                    raise  # the request itself was cancelled
+                if pool is not _sandbox_pool and attempt == 0:
+                    # Another submission's timeout replaced the pool while this one
+                    # was queued or running on it; that is not this code's fault
+                    continue
+                # The worker hit its CPU or memory limit and was killed
+                _shutdown_sandbox_pool()
+                error = "Execution error: resource limit exceeded"
+            except Exception as e:
+                error = f"Execution error: {str(e)[:50]}"
+            break
+    return [error] * len(specs), False
+
+def _count_code_lines(code: str) -> int:
+    """Count lines that are neither blank nor # comments."""
+    count = 0
+    for line in code.split("\n"):
+        stripped = line.strip()
+        if stripped and stripped[0] != "#":
+            count += 1
+    return count
+
+# Pattern-matching test types answered from the quest's shared scanner; these
+# need every occurrence found (or ruled out), so one full pass serves them all
+_SCANNED_TEST_TYPES = ("code_contains", "code_not_contains")
+
+def _is_any_of_test(test: dict, language: str) -> bool:
+    """Test cases that pass when at least one of their patterns occurs."""
+    test_type = test.get("type")
+    return test_type == "code_contains_any" or (test_type == "output_contains" and language != "python")
+
+# Test types that run the submission (Python only); they are evaluated together
+# in the sandbox worker pool rather than in this process
+_EXECUTED_TEST_TYPES = ("output_contains", "function_test")
+
+# Validators take the submitted code, the set of scanned patterns found in it
+# and the sandbox results, and return None when the test passes, a failure
+# message when it fails, or "" for a failure with nothing to report (unknown
+# test types)
+
+def _test_patterns(test: dict) -> tuple:
+    patterns = tuple(test.get("expected", []))
+    if not all(isinstance(p, str) for p in patterns):
+        raise TypeError("expected must be a list of strings")
+    return patterns
+
+def _compile_test(test: dict, language: str, scanned: bool = False):
+    """Specialise one test case into a validator closure.
+    scanned: the quest has a scanner pass anyway, so any-of test cases get
+    their patterns from it rather than searching the code themselves.
+    """
+    test_type = test.get("type")
+
+    if scanned and _is_any_of_test(test, language):
+        patterns = frozenset(_test_patterns(test))
+        if test_type == "code_contains_any":
+            message = f"Missing at least one of: {test.get('expected', [])}"
+        else:
+            message = f"Output check skipped for {language}"
+        def check(code, found, executed):
+            return message if found.isdisjoint(patterns) else None
+        return check
+
+    if test_type == "code_contains":
+        # Check if code contains all expected patterns
+        expected = _test_patterns(test)
+        required = frozenset(expected)
+        def check(code, found, executed):
+            # Passing is one C-level subset test; the ordered list of missing
+            # patterns is only built for the failure message
+            if required.issubset(found):
+                return None
+            missing = [p for p in expected if p not in found]
+            return f"Missing required code: {missing}"
+
+    elif test_type == "code_not_contains":
+        # Check if code does NOT contain forbidden patterns
+        forbidden = _test_patterns(test)
+        forbidden_set = frozenset(forbidden)
+        def check(code, found, executed):
+            if forbidden_set.isdisjoint(found):
+                return None
+            present = [p for p in forbidden if p in found]
+            return f"Forbidden code found: {present}"
+
+    elif test_type == "code_contains_any":
+        # Check if code contains at least one of the expected patterns
+        # Without a scanner pass for the quest: one match is enough, so a
+        # regex search that stops at the first hit beats scanning everything
+        expected = test.get("expected", [])
+        matcher = _compile_matcher(_test_patterns(test))
+        def check(code, found, executed):
+            if matcher is not None and matcher.search(code) is not None:
+                return None
+            return f"Missing at least one of: {expected}"
+
+    elif test_type == "output_contains" and language != "python":
+        # Output can only be checked for Python; for other languages just
+        # check the code contains the expected strings (any one will do, so
+        # search with the short-circuiting alternation)
+        matcher = _compile_matcher(_test_patterns(test))
+        def check(code, found, executed):
+            if matcher is not None and matcher.search(code) is not None:
+                return None
+            return f"Output check skipped for {language}"
+
+    elif test_type == "function_test" and language != "python":
+        def check(code, found, executed):
+            return None  # Skip function tests for non-Python
+
+    elif test_type == "code_line_count":
+        # Check code is within line limit
+        max_lines = test.get("max_lines", 100)
+        def check(code, found, executed):
+            # The raw line count bounds the code line count, so most
+            # submissions pass without looking at individual lines
+            if code.count("\n") + 1 <= max_lines:
+                return None
+            line_count = _count_code_lines(code)
+            if line_count <= max_lines:
+                return None
+            return f"Too many lines: {line_count} > {max_lines}"
+
+    elif test_type == "code_count":
+        # Count occurrences of a pattern
+        pattern = test.get("pattern", "")
+        # Generated quests spell the threshold "min" (that's what the Groq
+        # prompt asks for); without reading it they only ever required one
+        min_count = test.get("min_count", test.get("min", 1))
+        # Generated test cases are stored as Groq wrote them, so the threshold
+        # may arrive as a string or float; anything unusable means one
+        try:
+            min_count = int(min_count)
+        except (TypeError, ValueError):
+            min_count = 1
+        step = len(pattern) or 1
+        def check(code, found, executed):
+            # Passing only needs min_count occurrences, so stop searching at
+            # the last one needed rather than counting the whole submission
+            pos = 0
+            for _ in range(min_count):
+                pos = code.find(pattern, pos)
+                if pos < 0:
+                    break
+                pos += step
+            else:
+                return None
+            count = code.count(pattern)
+            if count >= min_count:
+                return None
+            return f"Pattern '{pattern}' found {count} times, need at least {min_count}"
 
-def validate_solution(code: str, quest_id) -> dict:
+    else:
+        def check(code, found, executed):
+            return ""
+
+    return check
+
+# Compiled validators and scanners shared by every quest with an identical test
+# case (or pattern set); replaced on each lookup rebuild so it doesn't outlive
+# deleted quests
+_validator_pool = {}
+
+def _pooled_test(test, language: str, pool: dict, scanned: bool = False):
+    """Return the shared validator for a test case, compiling it on first sight."""
+    try:
+        # Language only changes how the exec-based test types behave
+        key = (test.get("type"), orjson.dumps(test, option=orjson.OPT_SORT_KEYS))
+        if key[0] in ("output_contains", "function_test"):
+            key += (language,)
+        if scanned and _is_any_of_test(test, language):
+            key += ("scanned",)
+    except Exception:
+        return _compile_test(test, language, scanned)  # unhashable/odd shape: don't pool
+    check = pool.get(key)
+    if check is None:
+        check = pool[key] = _compile_test(test, language, scanned)
+    return check
+
+@functools.lru_cache(maxsize=None)
+def _executed_result(slot: int):
+    def check(code, found, executed):
+        return executed[slot]
+    return check
+
+def _sandbox_spec(test: dict) -> tuple:
+    """Reduce an executed test case to the picklable spec sandbox.run_tests takes."""
+    if test["type"] == "output_contains":
+        return ("output", tuple(test.get("expected", [])))
+    return ("function", test.get("function"), test.get("inputs", []), test.get("expected", []))
+
+def _compile_validators(quest: dict, pool: dict = None) -> tuple:
+    """Compile a quest's test cases into (scanner, validators, sandbox specs)."""
+    if pool is None:
+        pool = _validator_pool
+    language = quest.get("language", "python")
+    tests = quest.get("testCases") or []
+    validators = []
+    patterns = set()
+    specs = []
+    # When the quest needs a full scanner pass anyway, the any-of test cases
+    # ride along in it instead of each running its own regex search
+    scanned = any(isinstance(t, dict) and t.get("type") in _SCANNED_TEST_TYPES for t in tests)
+    for test in tests:
+        try:
+            if language == "python" and test.get("type") in _EXECUTED_TEST_TYPES:
+                specs.append(_sandbox_spec(test))
+                validators.append(_executed_result(len(specs) - 1))
+                continue
+            validators.append(_pooled_test(test, language, pool, scanned))
+            if test.get("type") in _SCANNED_TEST_TYPES or (scanned and _is_any_of_test(test, language)):
+                patterns.update(_test_patterns(test))
+        except Exception as e:
+            # Malformed test case: fail it on every submission, as before
+            message = f"Test error: {str(e)[:50]}"
+            validators.append(lambda code, found, executed, message=message: message)
+    scanner = None
+    if patterns:
+        scanner_key = frozenset(patterns)
+        scanner = pool.get(scanner_key)
+        if scanner is None:
+            scanner = pool[scanner_key] = _compile_scanner(scanner_key)
+    return scanner, tuple(validators), tuple(specs)
+
+async def validate_solution(code: str, quest_id) -> dict:
     """Validate a solution against test cases for a quest.
     quest_id can be an int (hardcoded) or a string (Firestore doc ID).
     """
-    quest = ALL_QUESTS.get(quest_id)
+    # Only the compiled validators are needed here, not the quest dict itself
+    compiled = QUEST_VALIDATORS.get(quest_id)
 
     # Also try integer lookup if quest_id is numeric
-    if not quest and isinstance(quest_id, (int, float)):
-        quest = ALL_QUESTS.get(int(quest_id))
+    if compiled is None and isinstance(quest_id, (int, float)):
+        quest_id = int(quest_id)  # also keys the result cache below
+        compiled = QUEST_VALIDATORS.get(quest_id)
 
-    if not quest:
+    if compiled is None:
         return {"passed": False, "message": "Quest not found", "tests_passed": 0, "tests_total": 0}
 
-    test_cases = quest.get("testCases", [])
-    if not test_cases:
+    scanner, validators, specs = compiled
+    if not validators:
         return {"passed": True, "message": "No test cases defined", "tests_passed": 0, "tests_total": 0}
 
+    # Students resubmit the same code a lot; validation is deterministic for a
+    # given quest and code, so repeat submissions are answered from the cache
+    cache_key = (quest_id, _code_digest(code))
+    cached = _validation_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+
     tests_passed = 0
-    tests_total = len(test_cases)
+    tests_total = len(validators)
     failed_tests = []
+    found = scanner(code) if scanner else frozenset()
+    executed, completed = await _run_in_sandbox(code, specs) if specs else ((), True)
 
-    for i, test in enumerate(test_cases):
-        test_type = test.get("type")
-
+    for check in validators:
         try:
-            if test_type == "code_contains":
-                # Check if code contains all expected patterns
-                expected = test.get("expected", [])
-                if all(pattern in code for pattern in expected):
-                    tests_passed += 1
-                else:
-                    missing = [p for p in expected if p not in code]
-                    failed_tests.append(f"Missing required code: {missing}")
-
-            elif test_type == "code_not_contains":
-                # Check if code does NOT contain forbidden patterns
-                forbidden = test.get("expected", [])
-                if not any(pattern in code for pattern in forbidden):
-                    tests_passed += 1
-                else:
-                    found = [p for p in forbidden if p in code]
-                    failed_tests.append(f"Forbidden code found: {found}")
-
-            elif test_type == "code_contains_any":
-                # Check if code contains at least one of the expected patterns
-                expected = test.get("expected", [])
-                if any(pattern in code for pattern in expected):
-                    tests_passed += 1
-                else:
-                    failed_tests.append(f"Missing at least one of: {expected}")
-
-            elif test_type == "output_contains":
-                # Run code and check if output contains expected strings
-                # Only works for Python quests
-                quest_lang = quest.get("language", "python")
-                if quest_lang != "python":
-                    # For non-Python, just check code contains the expected strings
-                    expected = test.get("expected", [])
-                    if any(exp in code for exp in expected):
-                        tests_passed += 1
-                    else:
-                        failed_tests.append(f"Output check skipped for {quest_lang}")
-                    continue
-
-                try:
-                    old_stdout = sys.stdout
-                    sys.stdout = buffer = io.StringIO()
-                    exec(code, {"__builtins__": __builtins__}, {})
-                    output = buffer.getvalue()
-                    sys.stdout = old_stdout
-
-                    expected = test.get("expected", [])
-                    if all(exp in output for exp in expected):
-                        tests_passed += 1
-                    else:
-                        missing = [e for e in expected if e not in output]
-                        failed_tests.append(f"Output missing: {missing}")
-                except Exception as e:
-                    failed_tests.append(f"Execution error: {str(e)[:50]}")
-
-            elif test_type == "function_test":
-                # Test a specific function with inputs (Python only)
-                quest_lang = quest.get("language", "python")
-                if quest_lang != "python":
-                    tests_passed += 1  # Skip function tests for non-Python
-                    continue
-
-                func_name = test.get("function")
-                inputs = test.get("inputs", [])
-                expected = test.get("expected", [])
-
-                try:
-                    local_vars = {}
-                    exec(code, {"__builtins__": __builtins__}, local_vars)
-
-                    # Try to find function with various naming conventions
-                    func = None
-                    for name in [func_name, func_name.replace("_", ""), func_name.lower()]:
-                        if name in local_vars and callable(local_vars[name]):
-                            func = local_vars[name]
-                            break
-
-                    if not func:
-                        # Try to find any function that could be it
-                        for name, val in local_vars.items():
-                            if callable(val) and not name.startswith("_"):
-                                func = val
-                                break
-
-                    if func:
-                        all_passed = True
-                        for inp, exp in zip(inputs, expected):
-                            result = func(*inp) if isinstance(inp, list) else func(inp)
-                            if result != exp:
-                                all_passed = False
-                                failed_tests.append(f"Function test failed: {func_name}({inp}) returned {result}, expected {exp}")
-                                break
-                        if all_passed:
-                            tests_passed += 1
-                    else:
-                        failed_tests.append(f"Function '{func_name}' not found")
-                except Exception as e:
-                    failed_tests.append(f"Function test error: {str(e)[:50]}")
-
-            elif test_type == "code_line_count":
-                # Check code is within line limit
-                max_lines = test.get("max_lines", 100)
-                lines = [l for l in code.split("\n") if l.strip() and not l.strip().startswith("#")]
-                if len(lines) <= max_lines:
-                    tests_passed += 1
-                else:
-                    failed_tests.append(f"Too many lines: {len(lines)} > {max_lines}")
-
-            elif test_type == "code_count":
-                # Count occurrences of a pattern
-                pattern = test.get("pattern", "")
-                min_count = test.get("min_count", 1)
-                count = code.count(pattern)
-                if count >= min_count:
-                    tests_passed += 1
-                else:
-                    failed_tests.append(f"Pattern '{pattern}' found {count} times, need at least {min_count}")
-
+            failure = check(code, found, executed)
         except Exception as e:
-            failed_tests.append(f"Test error: {str(e)[:50]}")
+            failure = f"Test error: {str(e)[:50]}"
+        if failure is None:
+            tests_passed += 1
+        elif failure and len(failed_tests) < MAX_FAILURE_DETAILS:
+            failed_tests.append(failure)
 
     passed = tests_passed >= (tests_total * 0.5)  # Pass if at least 50% of tests pass
 
-    return {
+    result = {
         "passed": passed,
         "tests_passed": tests_passed,
         "tests_total": tests_total,
         "message": "Solution accepted!" if passed else f"Solution failed: {failed_tests[0] if failed_tests else 'Unknown error'}",
-        "details": failed_tests[:3] if not passed else []  # Return first 3 failure details
+        "details": failed_tests if not passed else []  # First MAX_FAILURE_DETAILS failures
     }
+    # A timed-out or killed sandbox run may just mean the server was busy.
+    # The quest may also have been rebuilt (and the cache cleared) while the
+    # sandbox ran; a result from the old test cases must not be cached then.
+    if completed and QUEST_VALIDATORS.get(quest_id) is compiled:
+        _validation_cache[cache_key] = result
+    return dict(result)
 
 # --- Pydantic Models ---
 
-class CodeSession(BaseModel):
+class RequestModel(BaseModel):
+    # Request bodies are only read after parsing; unknown fields are dropped
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+class CodeSession(RequestModel):
     userId: str
     email: str
     code: str
@@ -291,15 +884,15 @@ class CodeSession(BaseModel):
     questId: Union[int, str, None] = None  # Quest ID (int for hardcoded, str for Firestore)
     behavioralSignals: Optional[dict] = None
 
-class QuestCreateRequest(BaseModel):
+class QuestCreateRequest(RequestModel):
     title: str
     task: str
     xp: int
     language: str
     level: str  # "Beginner", "Intermediate", "Advanced"
-    testCases: List[dict] = []
+    testCases: List[dict] = Field(default_factory=list)
 
-class QuestUpdateRequest(BaseModel):
+class QuestUpdateRequest(RequestModel):
     title: Optional[str] = None
     task: Optional[str] = None
     xp: Optional[int] = None
@@ -307,7 +900,7 @@ class QuestUpdateRequest(BaseModel):
     level: Optional[str] = None
     testCases: Optional[List[dict]] = None
 
-class QuestCompleteRequest(BaseModel):
+class QuestCompleteRequest(RequestModel):
     userId: str
     questId: str
     completionTimeMs: int
@@ -316,12 +909,32 @@ class QuestCompleteRequest(BaseModel):
     passed: bool
     questType: str = "reinforcement"  # reinforcement | stretch | weak_area
 
-class SessionStartRequest(BaseModel):
+class GeneratedQuest(BaseModel):
+    """One quest object from a Groq quest-generation response."""
+    model_config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+    title: str
+    task: str
+    xp: Optional[int] = None
+    questType: str = "reinforcement"
+    testCases: Optional[list] = None
+
+# Built once and reused: pydantic-core parses the model's JSON text straight
+# into GeneratedQuest items. Entries that don't fit fall through to Any and
+# are dropped, rather than failing the whole response.
+_generated_quests_adapter = TypeAdapter(
+    List[Annotated[Union[GeneratedQuest, Any], Field(union_mode="left_to_right")]]
+)
+
+def _parse_generated_quests(text: str) -> list:
+    """Valid quests from a Groq JSON array; raises ValidationError if it isn't one."""
+    return [q for q in _generated_quests_adapter.validate_json(text) if isinstance(q, GeneratedQuest)]
+
+class SessionStartRequest(RequestModel):
     userId: str
     email: str
     language: Optional[str] = None
 
-class BehavioralSignalsModel(BaseModel):
+class BehavioralSignalsModel(RequestModel):
     totalClipboardPastes: int = 0
     totalPasteCharacters: int = 0
     totalAutocompleteAccepts: int = 0
@@ -330,37 +943,40 @@ class BehavioralSignalsModel(BaseModel):
     totalRedos: int = 0
     totalFormatActions: int = 0
     totalSnippetInserts: int = 0
-    typingIntervals: List[float] = []
+    typingIntervals: List[float] = Field(default_factory=list)
     burstCount: int = 0
     totalDeletions: int = 0
     deletionCharacters: int = 0
 
-class SessionUpdateRequest(BaseModel):
+class SessionUpdateRequest(RequestModel):
     totalKeystrokes: int = 0
     totalPastes: int = 0
     totalEdits: int = 0
     activeDuration: float = 0
     idleDuration: float = 0
-    filesEdited: List[str] = []
-    languagesUsed: List[str] = []
+    filesEdited: List[str] = Field(default_factory=list)
+    languagesUsed: List[str] = Field(default_factory=list)
     behavioralSignals: Optional[BehavioralSignalsModel] = None
 
-class SessionEndRequest(BaseModel):
+class SessionEndRequest(RequestModel):
     totalKeystrokes: int = 0
     totalPastes: int = 0
     totalEdits: int = 0
     totalDuration: float = 0
     activeDuration: float = 0
     idleDuration: float = 0
-    filesEdited: List[str] = []
-    languagesUsed: List[str] = []
+    filesEdited: List[str] = Field(default_factory=list)
+    languagesUsed: List[str] = Field(default_factory=list)
     behavioralSignals: Optional[BehavioralSignalsModel] = None
     snapshotCode: Optional[str] = None      # Current file code at session end
     snapshotLanguage: Optional[str] = None  # Language of the snapshot file
 
-class AIDetectRequest(BaseModel):
+class AIDetectRequest(RequestModel):
     sessionId: str
 
+class ClassifyBatchRequest(RequestModel):
+    codes: List[str]
+
 # --- AI Detection Engine (Physics-Based Behavioral Analysis) ---
 
 class AIDetectionEngine:
@@ -403,7 +1019,6 @@ class AIDetectionEngine:
         bs = session_data.get("behavioralSignals", {}) or {}
 
         total_keystrokes = session_data.get("totalKeystrokes", 0)
-        total_pastes = session_data.get("totalPastes", 0)
         total_edits = session_data.get("totalEdits", 0)
         active_duration = session_data.get("activeDuration", 0)
         idle_duration = session_data.get("idleDuration", 0)
@@ -517,7 +1132,6 @@ class AIDetectionEngine:
         # --- Signal 4: Deletion Ratio ---
         # Humans delete/correct frequently. AI-generated code is pasted clean.
         total_deletions = bs.get("totalDeletions", 0)
-        deletion_chars = bs.get("deletionCharacters", 0)
         deletion_ratio = total_deletions / (total_edits + 0.1) if total_edits > 0 else 0
 
         if total_edits < 5:
@@ -559,7 +1173,7 @@ class AIDetectionEngine:
             bp_desc = f"{effective_bursts} large insertion events detected"
         else:
             bp_score, bp_verdict = 10, "human"
-            bp_desc = f"No significant paste bursts — steady coding rhythm"
+            bp_desc = "No significant paste bursts — steady coding rhythm"
 
         signals["burst_pattern"] = {
             "name": "Burst Pattern",
@@ -572,7 +1186,6 @@ class AIDetectionEngine:
 
         # --- Signal 6: Copilot / AI Tool Usage ---
         copilot_accepts = bs.get("totalCopilotAccepts", 0)
-        autocomplete_accepts = bs.get("totalAutocompleteAccepts", 0)
         # Copilot is a direct AI signal. Autocomplete is normal IDE behavior.
         if copilot_accepts > 10:
             cu_score, cu_verdict = 90, "ai_likely"
@@ -599,7 +1212,6 @@ class AIDetectionEngine:
         # --- Signal 7: Undo/Redo Ratio ---
         # Humans undo frequently while experimenting. Pure AI paste = no undos.
         total_undos = bs.get("totalUndos", 0)
-        total_redos = bs.get("totalRedos", 0)
         undo_ratio = total_undos / (total_edits + 0.1) if total_edits > 0 else 0
 
         if total_edits < 5:
@@ -706,30 +1318,66 @@ class AIDetectionEngine:
 
 # --- API Endpoints ---
 
+# Health checks must reach this process, never a cached copy of an old answer
+_NO_STORE = {"Cache-Control": "no-store"}
+
 @app.get("/")
-async def root():
+async def root(response: Response):
     """Health check endpoint."""
+    response.headers.update(_NO_STORE)
     return {"status": "ok", "message": "DevSkill Tracker API is running"}
 
 @app.get("/health")
-async def health_check():
+async def health_check(response: Response):
     """Health check endpoint for monitoring."""
+    response.headers.update(_NO_STORE)
     return {"status": "healthy", "version": "1.0.0"}
 
+def _email_index_key(email: str) -> str:
+    """Document id in email_to_uid for an email (hashed: emails can contain '/').
+    Takes the email as stored on the user doc, so it matches exactly like the
+    users query it stands in for.
+    """
+    return hashlib.sha1(email.encode("utf-8")).hexdigest()
+
 @app.get("/get-user-id/{email}")
 async def get_user_id(email: str):
     """Returns the userId (Firebase Auth UID) for a given email address."""
+    # Register stores the trimmed email as typed, and the users query matches
+    # it exactly; every path below uses this same form
+    email = email.strip()
+    cached = _user_id_cache.get(email)
+    if cached:
+        return {"status": "success", "userId": cached, "email": email}
     try:
-        users_ref = db.collection("users").where(filter=FieldFilter("email", "==", email)).stream()
+        # Point read on the email index first; only fall back to querying users
+        # for emails that haven't been looked up (and indexed) before
+        index_ref = db.collection("email_to_uid").document(_email_index_key(email))
+        index_doc = await index_ref.get()
+        user_id = None
+        if index_doc.exists:
+            # Users docs are written by the frontend, which doesn't maintain this
+            # index, so make sure the user still exists with this email
+            user_doc = await users_col.document(index_doc.get("userId")).get()
+            if user_doc.exists and (user_doc.to_dict() or {}).get("email") == email:
+                user_id = user_doc.id
+            else:
+                await index_ref.delete()
+        if not user_id:
+            query = users_col.where(filter=FieldFilter("email", "==", email)).limit(1)
+            async for doc in query.stream():
+                user_id = doc.id
+                await index_ref.set({"userId": user_id, "email": email})
 
-        for doc in users_ref:
-            return {
-                "status": "success",
-                "userId": doc.id,
-                "email": email
-            }
+        if not user_id:
+            raise HTTPException(status_code=404, detail=f"User not found: {email}")
 
-        raise HTTPException(status_code=404, detail=f"User not found: {email}")
+        _user_id_cache[email] = user_id
+        return {
+            "status": "success",
+            "userId": user_id,
+            "email": email
+        }
 
     except HTTPException:
         raise
@@ -784,45 +1432,47 @@ def generate_tips(skill_level: str, ai_probability: float, signals: dict) -> lis
 
 # --- Persistent Session Endpoints ---
 
+# Constant fields of a new session document (immutable values only; the lists
+# are added per session)
+_NEW_SESSION_TEMPLATE = {
+    "status": "active",
+    "sessionType": "extension",
+    "timestamp": firestore.SERVER_TIMESTAMP,
+    "startTime": firestore.SERVER_TIMESTAMP,
+    "endTime": None,
+    "totalKeystrokes": 0,
+    "totalPastes": 0,
+    "totalEdits": 0,
+    "totalDuration": 0,
+    "activeDuration": 0,
+    "idleDuration": 0,
+}
+
 @app.post("/session/start")
 async def session_start(req: SessionStartRequest):
     """Create a new persistent session. Returns sessionId. Call once when tracking starts."""
     try:
         session_id = str(uuid.uuid4())
-        doc_data = {
-            "sessionId": session_id,
-            "userId": req.userId,
-            "email": req.email,
-            "status": "active",
-            "language": req.language,
-            "sessionType": "extension",
-            "timestamp": firestore.SERVER_TIMESTAMP,
-            "startTime": firestore.SERVER_TIMESTAMP,
-            "endTime": None,
-            "totalKeystrokes": 0,
-            "totalPastes": 0,
-            "totalEdits": 0,
-            "totalDuration": 0,
-            "activeDuration": 0,
-            "idleDuration": 0,
-            "filesEdited": [],
-            "languagesUsed": [],
-        }
-        db.collection("sessions").document(session_id).set(doc_data)
+        doc_data = _NEW_SESSION_TEMPLATE.copy()
+        doc_data.update(
+            sessionId=session_id,
+            userId=req.userId,
+            email=req.email,
+            language=req.language,
+            filesEdited=[],
+            languagesUsed=[],
+        )
+        await sessions_col.document(session_id).set(doc_data)
+        _language_cache.pop(req.userId, None)
         return {"status": "success", "sessionId": session_id}
     except Exception as e:
-        print(f"Session start error: {e}")
+        logger.exception("Session start error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/session/{session_id}/update")
 async def session_update(session_id: str, req: SessionUpdateRequest):
     """Update an active session with latest metrics. Call periodically (e.g., every 30s)."""
     try:
-        doc_ref = db.collection("sessions").document(session_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail="Session not found")
-
         update_data = {
             "totalKeystrokes": req.totalKeystrokes,
             "totalPastes": req.totalPastes,
@@ -834,13 +1484,17 @@ async def session_update(session_id: str, req: SessionUpdateRequest):
             "lastUpdated": firestore.SERVER_TIMESTAMP,
         }
         if req.behavioralSignals:
-            update_data["behavioralSignals"] = req.behavioralSignals.dict()
-        doc_ref.update(update_data)
+            update_data["behavioralSignals"] = req.behavioralSignals.model_dump()
+        # update() fails for a missing document, so no separate existence read
+        try:
+            await sessions_col.document(session_id).update(update_data)
+        except NotFound:
+            raise HTTPException(status_code=404, detail="Session not found")
         return {"status": "success", "sessionId": session_id}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Session update error: {e}")
+        logger.exception("Session update error")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -924,19 +1578,19 @@ def fuse_skill_with_behavior(
         f_beg = W_GQ * g_beg + W_CB * beg_p + W_BH * b_beg
         f_mid = W_GQ * g_mid + W_CB * mid_p + W_BH * b_mid
         f_adv = W_GQ * g_adv + W_CB * adv_p + W_BH * b_adv
-        print(f"[SkillFusion] Groq={groq_label}({groq_confidence:.2f}) behavioral={behavioral_score:.2f} cb=[{beg_p:.2f},{mid_p:.2f},{adv_p:.2f}]")
+        logger.info("[SkillFusion] Groq=%s(%.2f) behavioral=%.2f cb=[%.2f,%.2f,%.2f]", groq_label, groq_confidence, behavioral_score, beg_p, mid_p, adv_p)
     else:
         # No Groq: CodeBERT 60%, behavioral 40%
         W_CB, W_BH = 0.60, 0.40
         f_beg = W_CB * beg_p + W_BH * b_beg
         f_mid = W_CB * mid_p + W_BH * b_mid
         f_adv = W_CB * adv_p + W_BH * b_adv
-        print(f"[SkillFusion] (no Groq) behavioral={behavioral_score:.2f} cb=[{beg_p:.2f},{mid_p:.2f},{adv_p:.2f}]")
+        logger.info("[SkillFusion] (no Groq) behavioral=%.2f cb=[%.2f,%.2f,%.2f]", behavioral_score, beg_p, mid_p, adv_p)
 
     fused = {"Beginner": f_beg, "Intermediate": f_mid, "Advanced": f_adv}
     best_label = max(fused, key=fused.get)
     confidence = fused[best_label] / sum(fused.values()) * 100
-    print(f"[SkillFusion] → {best_label} ({confidence:.1f}%)")
+    logger.info("[SkillFusion] → %s (%.1f%%)", best_label, confidence)
 
     return best_label, confidence
 
@@ -945,10 +1599,7 @@ def fuse_skill_with_behavior(
 async def session_end(session_id: str, req: SessionEndRequest):
     """End a session. Call when user stops tracking or exits VS Code."""
     try:
-        doc_ref = db.collection("sessions").document(session_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail="Session not found")
+        doc_ref = sessions_col.document(session_id)
 
         num_languages = len(req.languagesUsed) if req.languagesUsed else 0
         num_files = len(req.filesEdited) if req.filesEdited else 0
@@ -958,12 +1609,12 @@ async def session_end(session_id: str, req: SessionEndRequest):
         confidence = 0.0
         if req.snapshotCode:
             lang = (req.languagesUsed or ["python"])[0]
-            groq_label, groq_conf = _classify_code_groq(req.snapshotCode, lang)
+            groq_label, groq_conf = await _run_groq(_classify_code_groq, req.snapshotCode, lang)
             try:
-                probs = ai_model.predict_proba([req.snapshotCode])[0] if ai_model else [0.33, 0.34, 0.33]
+                probs = await model_batcher.predict_proba(req.snapshotCode) if await _loaded_model() else [0.33, 0.34, 0.33]
                 skill_level, confidence = fuse_skill_with_behavior(probs, req, groq_label, groq_conf)
-            except Exception as model_err:
-                print(f"CodeBERT error on snapshot: {model_err}")
+            except Exception:
+                logger.exception("CodeBERT error on snapshot")
                 if groq_label:
                     skill_level, confidence = groq_label, groq_conf * 100
                 advanced_langs = {"typescript", "rust", "go", "kotlin", "scala", "swift"}
@@ -990,7 +1641,7 @@ async def session_end(session_id: str, req: SessionEndRequest):
             "activeDuration": req.activeDuration,
             "idleDuration": req.idleDuration,
             "totalDuration": req.totalDuration,
-            "behavioralSignals": req.behavioralSignals.dict() if req.behavioralSignals else {}
+            "behavioralSignals": req.behavioralSignals.model_dump() if req.behavioralSignals else {}
         }
         detection_result = AIDetectionEngine.analyze(detection_input)
         ai_probability = detection_result["aiLikelihoodScore"]
@@ -1035,13 +1686,17 @@ async def session_end(session_id: str, req: SessionEndRequest):
             }
         }
         if req.behavioralSignals:
-            update_data["behavioralSignals"] = req.behavioralSignals.dict()
-        doc_ref.update(update_data)
+            update_data["behavioralSignals"] = req.behavioralSignals.model_dump()
+        # update() fails for a missing document, so no separate existence read
+        try:
+            await doc_ref.update(update_data)
+        except NotFound:
+            raise HTTPException(status_code=404, detail="Session not found")
         return {"status": "success", "sessionId": session_id}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Session end error: {e}")
+        logger.exception("Session end error")
         raise HTTPException(status_code=500, detail=str(e))
 
 # --- Quest Endpoints (AI-generated + Firestore cached) ---
@@ -1053,11 +1708,18 @@ try:
     _groq_api_key = os.environ.get("GROQ_API_KEY")
     if _groq_api_key:
         _groq_client = GroqClient(api_key=_groq_api_key)
-        print("Groq client initialized for AI quest generation")
+        logger.info("Groq client initialized for AI quest generation")
     else:
-        print("Warning: GROQ_API_KEY not set. AI quest generation disabled.")
+        logger.warning("GROQ_API_KEY not set. AI quest generation disabled.")
 except ImportError:
-    print("Warning: groq package not installed. Run: pip install groq")
+    logger.warning("groq package not installed. Run: pip install groq")
+
+async def _run_groq(func, *args):
+    """Run a blocking Groq helper on a worker thread.
+    The Groq client is synchronous; calling it from a handler would hold the
+    event loop for the whole completion (seconds for quest generation).
+    """
+    return await anyio.to_thread.run_sync(func, *args)
 
 def _classify_code_groq(code: str, language: str = "python") -> tuple:
     """Use Groq/Llama to classify code skill level. Returns (label, confidence_0_to_1)."""
@@ -1079,46 +1741,66 @@ Code to classify:
 ```"""
     try:
         text = _strip_markdown_fences(_call_groq(prompt, max_tokens=50))
-        result = json.loads(text)
+        result = orjson.loads(text)
         label = result.get("level", "").strip()
         if label not in ("Beginner", "Intermediate", "Advanced"):
             return None, 0.0
         confidence = float(result.get("confidence", 0.8))
-        print(f"[GroqClassifier] {label} ({confidence:.2f})")
+        logger.info("[GroqClassifier] %s (%.2f)", label, confidence)
         return label, confidence
-    except Exception as e:
-        print(f"[GroqClassifier] Error: {e}")
+    except Exception:
+        logger.exception("[GroqClassifier] Error")
         return None, 0.0
 
 
+# Aliases (file extensions, short names) -> the language key quests are stored under
+LANGUAGE_ALIASES = {
+    "python": "python", "py": "python",
+    "javascript": "javascript", "js": "javascript",
+    "typescript": "typescript", "ts": "typescript",
+    "java": "java",
+    "csharp": "csharp", "c#": "csharp", "cs": "csharp",
+    "html": "html", "htm": "html",
+    "css": "css", "scss": "css", "sass": "css",
+    "c": "c", "cpp": "cpp", "c++": "cpp",
+    "go": "go", "golang": "go",
+    "rust": "rust", "rs": "rust",
+    "ruby": "ruby", "rb": "ruby",
+    "php": "php",
+    "swift": "swift",
+    "kotlin": "kotlin", "kt": "kotlin",
+    "r": "r",
+    "sql": "sql",
+    "shell": "shell", "bash": "shell", "sh": "shell",
+}
+
+# Canonical spelling of each skill level, keyed by its lowercase form
+SKILL_LEVELS = {"beginner": "Beginner", "intermediate": "Intermediate", "advanced": "Advanced"}
+
+# Both take values from a small set that repeats on every request, so the
+# lower()/strip()/lookup work is memoized per distinct input
+@functools.lru_cache(maxsize=256)
 def _normalize_language(language: str) -> str:
     """Normalize language name to a standard key."""
     lang = (language or "python").lower().strip()
-    lang_map = {
-        "python": "python", "py": "python",
-        "javascript": "javascript", "js": "javascript",
-        "typescript": "typescript", "ts": "typescript",
-        "java": "java",
-        "csharp": "csharp", "c#": "csharp", "cs": "csharp",
-        "html": "html", "htm": "html",
-        "css": "css", "scss": "css", "sass": "css",
-        "c": "c", "cpp": "cpp", "c++": "cpp",
-        "go": "go", "golang": "go",
-        "rust": "rust", "rs": "rust",
-        "ruby": "ruby", "rb": "ruby",
-        "php": "php",
-        "swift": "swift",
-        "kotlin": "kotlin", "kt": "kotlin",
-        "r": "r",
-        "sql": "sql",
-        "shell": "shell", "bash": "shell", "sh": "shell",
-    }
-    return lang_map.get(lang, lang)
+    return LANGUAGE_ALIASES.get(lang, lang)
+
+@functools.lru_cache(maxsize=64)
+def _normalize_level(level: str) -> str:
+    """Map a skill level in any casing to its canonical name (default Beginner)."""
+    return SKILL_LEVELS.get((level or "").strip().lower(), "Beginner")
 
 async def _get_quests_from_firestore(language: str, level: str) -> list:
     """Fetch quests from Firestore for a given language and level."""
+    if _quest_index_fresh():
+        indexed = QUESTS_BY_LANGUAGE_LEVEL.get((language, level))
+        if indexed:
+            return list(indexed)
+    cached = _quest_query_cache.get((language, level))
+    if cached:
+        return [dict(q) for q in cached]
     try:
-        quests_ref = db.collection("quests")
+        quests_ref = quests_col
         query = quests_ref.where(
             filter=FieldFilter("language", "==", language)
         ).where(
@@ -1126,13 +1808,15 @@ async def _get_quests_from_firestore(language: str, level: str) -> list:
         )
         docs = query.stream()
         quests = []
-        for doc in docs:
+        async for doc in docs:
             quest_data = doc.to_dict()
             quest_data["id"] = doc.id
             quests.append(quest_data)
-        return quests
-    except Exception as e:
-        print(f"Firestore quest fetch error: {e}")
+        if quests:
+            _quest_query_cache[(language, level)] = tuple(quests)
+        return [dict(q) for q in quests]
+    except Exception:
+        logger.exception("Firestore quest fetch error")
         return []
 
 def _call_groq(prompt: str, max_tokens: int = 4000) -> str:
@@ -1206,57 +1890,73 @@ Return ONLY the JSON array, nothing else."""
 
     try:
         text = _strip_markdown_fences(_call_groq(prompt, max_tokens=4000))
-        quests = json.loads(text)
-
-        if not isinstance(quests, list):
-            print(f"AI returned non-list: {type(quests)}")
+        try:
+            quests = _parse_generated_quests(text)
+        except ValidationError as e:
+            logger.warning("AI returned no quest list: %s", e)
             return []
 
-        # Validate and clean each quest
-        valid_quests = []
-        for q in quests:
-            if isinstance(q, dict) and "title" in q and "task" in q:
-                valid_quests.append({
-                    "title": str(q.get("title", "")),
-                    "task": str(q.get("task", "")),
-                    "xp": int(q.get("xp", 50)),
-                    "testCases": q.get("testCases", []),
-                    "language": language,
-                    "level": level,
-                })
-
-        print(f"AI generated {len(valid_quests)} {language}/{level} quests")
+        valid_quests = [{
+            "title": q.title,
+            "task": q.task,
+            "xp": 50 if q.xp is None else q.xp,
+            "testCases": q.testCases or [],
+            "language": language,
+            "level": level,
+        } for q in quests]
+
+        logger.info("AI generated %s %s/%s quests", len(valid_quests), language, level)
         return valid_quests
 
-    except Exception as e:
-        print(f"AI quest generation error: {e}")
+    except Exception:
+        logger.exception("AI quest generation error")
         return []
 
-def _save_generated_quests_to_firestore(quests: list, language: str, level: str):
+async def _save_generated_quests_to_firestore(quests: list, language: str, level: str):
     """Save AI-generated quests to Firestore for caching."""
-    saved = 0
+    candidates = {}  # doc_id -> (doc_ref, data); keyed so duplicate titles are written once
     for quest in quests:
         try:
             doc_id = f"{language}_{quest['title'].lower().replace(' ', '_').replace('/', '_')}"
-            doc_ref = db.collection("quests").document(doc_id)
-            if not doc_ref.get().exists:
-                doc_data = {
-                    "title": quest["title"],
-                    "task": quest["task"],
-                    "xp": quest["xp"],
-                    "language": language,
-                    "level": level,
-                    "testCases": quest.get("testCases", []),
-                    "generatedBy": "ai",
-                    "createdAt": firestore.SERVER_TIMESTAMP,
-                }
-                doc_ref.set(doc_data)
-                saved += 1
-        except Exception as e:
-            print(f"Error saving quest to Firestore: {e}")
+            if doc_id in candidates:
+                continue
+            doc_data = {
+                "title": quest["title"],
+                "task": quest["task"],
+                "xp": quest["xp"],
+                "language": language,
+                "level": level,
+                "testCases": quest.get("testCases", []),
+                "generatedBy": "ai",
+                "createdAt": firestore.SERVER_TIMESTAMP,
+            }
+            candidates[doc_id] = (quests_col.document(doc_id), doc_data)
+        except Exception:
+            logger.exception("Error saving quest to Firestore")
+
+    saved = 0
+    if _quest_watch is not None:
+        # Doc ids are derived from language and title, so ALL_QUESTS is already
+        # the (language, title) index; with the listener keeping it current, a
+        # quest found there needn't be checked in Firestore again
+        candidates = {doc_id: c for doc_id, c in candidates.items() if doc_id not in ALL_QUESTS}
+    if candidates:
+        try:
+            # One get_all round trip to find existing quests instead of a get() per quest
+            refs = [doc_ref for doc_ref, _ in candidates.values()]
+            existing = {snap.id async for snap in db.get_all(refs) if snap.exists}
+            writes = [
+                (doc_ref, doc_data, "set")
+                for doc_id, (doc_ref, doc_data) in candidates.items()
+                if doc_id not in existing
+            ]
+            await _commit_batched(writes)
+            saved = len(writes)
+        except Exception:
+            logger.exception("Error saving quests to Firestore")
     if saved:
-        print(f"Cached {saved} AI-generated {language}/{level} quests to Firestore")
-        _rebuild_quest_lookup()
+        logger.info("Cached %s AI-generated %s/%s quests to Firestore", saved, language, level)
+        await _quests_written()
 
 async def _get_or_generate_quests(language: str, level: str, count: int = 8) -> list:
     """Get quests from Firestore cache, or generate with Groq if none exist."""
@@ -1264,34 +1964,60 @@ async def _get_or_generate_quests(language: str, level: str, count: int = 8) ->
     if quests:
         return quests
 
-    generated = _generate_quests_ai(language, level, count)
+    generated = await _run_groq(_generate_quests_ai, language, level, count)
     if generated:
-        _save_generated_quests_to_firestore(generated, language, level)
+        await _save_generated_quests_to_firestore(generated, language, level)
         return generated
 
     return []
 
+# Dedicated generator for quest selection, bound once instead of going through
+# the random module's shared instance on every call
+_rng = random.Random()
+# Gunicorn forks every worker from the preloaded master, so without a reseed
+# they would all inherit this state and hand out the same "random" quests
+# (the random module does this for its own instance, not for ours)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_rng.seed)
+
 @app.get("/get-quest/{skill_level}")
 async def get_quest(skill_level: str, language: Optional[str] = None):
     """Returns a random challenge. Auto-generates quests via AI for any language."""
     lang = _normalize_language(language)
+    skill_level = _normalize_level(skill_level)
+    # Indexed quests already carry this language; send their prebuilt bytes
+    encoded = QUEST_JSON_BY_LANGUAGE_LEVEL.get((lang, skill_level)) if _quest_index_fresh() else None
+    if encoded:
+        return Response(encoded[_rng.randrange(len(encoded))][0], media_type="application/json")
+
     quests = await _get_or_generate_quests(lang, skill_level)
 
     if not quests:
         raise HTTPException(status_code=404, detail=f"No quests available for {lang}/{skill_level}. Set GROQ_API_KEY to enable AI quest generation.")
 
-    quest = random.choice(quests)
+    quest = quests[_rng.randrange(len(quests))]
     return {**quest, "language": lang}
 
 @app.get("/get-quests/{skill_level}")
 async def get_quests(skill_level: str, language: Optional[str] = None, count: int = 8):
     """Returns multiple quests. Auto-generates via AI for any detected language."""
     lang = _normalize_language(language)
+    skill_level = _normalize_level(skill_level)
+    encoded = QUEST_JSON_BY_LANGUAGE_LEVEL.get((lang, skill_level)) if _quest_index_fresh() else None
+    if encoded:
+        picks = _rng.sample(encoded, max(0, min(count, len(encoded))))
+        generated = any(is_ai for _, is_ai in picks)
+        body = b"".join((
+            b'{"quests":[', b",".join(blob for blob, _ in picks),
+            b'],"total":', str(len(encoded)).encode(),
+            b',"generated":', b"true" if generated else b"false", b"}",
+        ))
+        return Response(body, media_type="application/json")
+
     quests = await _get_or_generate_quests(lang, skill_level, count)
 
-    # Shuffle and limit
-    random.shuffle(quests)
-    selected = quests[:min(count, len(quests))]
+    # Random selection without shuffling the whole list
+    selected = _rng.sample(quests, max(0, min(count, len(quests))))
 
     return {
         "quests": [{**q, "language": lang} for q in selected],
@@ -1302,15 +2028,19 @@ async def get_quests(skill_level: str, language: Optional[str] = None, count: in
 @app.get("/detect-language/{user_id}")
 async def detect_language(user_id: str):
     """Detect the most-used language from a user's recent sessions."""
+    # This reads every session the user has, so repeat calls reuse the result
+    cached = _language_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         lang_counts = {}
 
-        sessions_ref = db.collection("sessions").where(
+        sessions_ref = sessions_col.where(
             filter=FieldFilter("userId", "==", user_id)
         )
         docs = sessions_ref.stream()
 
-        for doc in docs:
+        async for doc in docs:
             data = doc.to_dict()
             for lang in data.get("languagesUsed", []):
                 normalized = _normalize_language(lang)
@@ -1320,35 +2050,59 @@ async def detect_language(user_id: str):
                 lang_counts[normalized] = lang_counts.get(normalized, 0) + 1
 
         if not lang_counts:
-            return {"language": "python", "confidence": 0, "all": {}}
-
-        detected = max(lang_counts, key=lang_counts.get)
-        return {"language": detected, "confidence": lang_counts[detected], "all": lang_counts}
-    except Exception as e:
-        print(f"Language detection error: {e}")
+            result = {"language": "python", "confidence": 0, "all": {}}
+        else:
+            detected = max(lang_counts, key=lang_counts.get)
+            result = {"language": detected, "confidence": lang_counts[detected], "all": lang_counts}
+        _language_cache[user_id] = result
+        return result
+    except Exception:
+        logger.exception("Language detection error")
         return {"language": "python", "confidence": 0, "all": {}}
 
+def _quest_languages_payload(language_counts: dict) -> dict:
+    return {"languages": [
+        {"id": lang, "name": lang.capitalize(), "questCount": count}
+        for lang, count in language_counts.items()
+    ]}
+
+# Quest counts move whenever quests are generated or edited, so clients reuse
+# the list for a few minutes and then revalidate it against the ETag
+QUEST_LANGUAGES_MAX_AGE = 300
+
 @app.get("/get-quest-languages")
-async def get_quest_languages():
+async def get_quest_languages(request: Request):
     """Returns languages that have quests in Firestore."""
+    # Serve the blob pre-serialized by _build_quest_lookup while it's fresh
+    if _quest_languages_blob and _quest_index_fresh():
+        headers = {
+            "ETag": _quest_languages_etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": f"public, max-age={QUEST_LANGUAGES_MAX_AGE}",
+        }
+        if request.headers.get("if-none-match") == _quest_languages_etag:
+            return Response(status_code=304, headers=headers)
+        # Hand out the pre-compressed copy rather than gzipping on every request
+        if _quest_languages_blob_gz and "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            return Response(_quest_languages_blob_gz, media_type="application/json", headers=headers)
+        return Response(_quest_languages_blob, media_type="application/json", headers=headers)
+
     language_counts = {}
     try:
-        for doc in db.collection("quests").stream():
+        async for doc in quests_col.stream():
             lang = doc.to_dict().get("language", "python")
             language_counts[lang] = language_counts.get(lang, 0) + 1
-    except Exception as e:
-        print(f"Error fetching quest languages: {e}")
+    except Exception:
+        logger.exception("Error fetching quest languages")
 
-    return {"languages": [
-        {"id": lang, "name": lang.capitalize(), "questCount": count}
-        for lang, count in language_counts.items()
-    ]}
+    return _quest_languages_payload(language_counts)
 
 # --- Personalized Daily Quest System ---
 
 async def _get_user_context(user_id: str) -> dict:
     """Build user context from recent sessions and quest meta for personalized generation."""
-    from datetime import date as date_type
+    global _sessions_index_ready
     context = {
         "skill_level": "Beginner",
         "language": "python",
@@ -1366,7 +2120,7 @@ async def _get_user_context(user_id: str) -> dict:
     try:
         # Fetch quest meta
         meta_ref = db.collection("student_quest_meta").document(user_id)
-        meta_snap = meta_ref.get()
+        meta_snap = await meta_ref.get()
         if meta_snap.exists:
             meta = meta_snap.to_dict()
             context["difficulty_score"] = meta.get("difficultyScore", 3)
@@ -1376,16 +2130,21 @@ async def _get_user_context(user_id: str) -> dict:
             context["recent_quest_performance"] = meta.get("recentQuestPerformance", [])
 
         # Fetch last 5 sessions
-        try:
-            sessions_query = db.collection("sessions").where(
-                filter=FieldFilter("userId", "==", user_id)
-            ).order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5)
-            sessions_docs = list(sessions_query.stream())
-        except Exception:
-            sessions_query = db.collection("sessions").where(
-                filter=FieldFilter("userId", "==", user_id)
-            )
-            sessions_docs = list(sessions_query.stream())[:5]
+        user_sessions = sessions_col.where(filter=FieldFilter("userId", "==", user_id))
+        sessions_docs = None
+        if _sessions_index_ready:
+            try:
+                sessions_query = user_sessions.order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5)
+                sessions_docs = [doc async for doc in sessions_query.stream()]
+            except FailedPrecondition:
+                _sessions_index_ready = False
+        if sessions_docs is None:
+            # No index: read the user's sessions unordered and keep the newest
+            def _timestamp(doc):
+                ts = (doc.to_dict() or {}).get("timestamp")
+                return (ts is not None, ts)
+            all_docs = [doc async for doc in user_sessions.stream()]
+            sessions_docs = sorted(all_docs, key=_timestamp, reverse=True)[:5]
 
         if sessions_docs:
             skill_counts = {"Beginner": 0, "Intermediate": 0, "Advanced": 0}
@@ -1422,8 +2181,8 @@ async def _get_user_context(user_id: str) -> dict:
                 context["idle_ratio"] = round(total_idle / total_time, 2)
             context["avg_session_duration"] = int(total_active / max(len(sessions_docs), 1))
 
-    except Exception as e:
-        print(f"Error building user context: {e}")
+    except Exception:
+        logger.exception("Error building user context")
     return context
 
 
@@ -1504,8 +2263,9 @@ Return ONLY the JSON array of 10 quest objects."""
 
     try:
         text = _strip_markdown_fences(_call_groq(prompt, max_tokens=3000))
-        quests = json.loads(text)
-        if not isinstance(quests, list):
+        try:
+            quests = _parse_generated_quests(text)
+        except ValidationError:
             return []
 
         def _sanitize_test_cases(raw):
@@ -1524,23 +2284,20 @@ Return ONLY the JSON array of 10 quest objects."""
                 result.append({"type": str(tc.get("type", "code_contains")), "expected": flat})
             return result
 
-        valid = []
-        for q in quests:
-            if isinstance(q, dict) and "title" in q and "task" in q:
-                valid.append({
-                    "title": str(q.get("title", "")),
-                    "task": str(q.get("task", "")),
-                    "xp": int(q.get("xp", 60)),
-                    "questType": str(q.get("questType", "reinforcement")),
-                    "testCases": _sanitize_test_cases(q.get("testCases", [])),
-                    "language": lang,
-                    "level": skill,
-                    "isPersonal": True,
-                })
-        print(f"Generated {len(valid)} personalized quests for user ({skill}/{lang}/diff:{diff})")
+        valid = [{
+            "title": q.title,
+            "task": q.task,
+            "xp": 60 if q.xp is None else q.xp,
+            "questType": q.questType,
+            "testCases": _sanitize_test_cases(q.testCases),
+            "language": lang,
+            "level": skill,
+            "isPersonal": True,
+        } for q in quests]
+        logger.info("Generated %s personalized quests for user (%s/%s/diff:%s)", len(valid), skill, lang, diff)
         return valid
-    except Exception as e:
-        print(f"Personalized quest generation error: {e}")
+    except Exception:
+        logger.exception("Personalized quest generation error")
         return []
 
 
@@ -1549,8 +2306,7 @@ async def get_daily_quests(user_id: str, language: Optional[str] = None):
     """Return personalized quests for a user.
     Cache key is tied to the latest session ID so quests refresh after each new session.
     Optional ?language= param overrides the detected language."""
-    from datetime import date as date_type
-    today = date_type.today().isoformat()
+    today = datetime.date.today().isoformat()
     lang_override = _normalize_language(language) if language else None
 
     if not _groq_client:
@@ -1561,38 +2317,39 @@ async def get_daily_quests(user_id: str, language: Optional[str] = None):
         if lang_override:
             context["language"] = lang_override
         lang = context["language"]
-        skill = context["skill_level"]
         latest_session_id = context.get("latest_session_id") or today
 
         # Always generate fresh quests on every visit (no cache check)
-        quests = _generate_personalized_quests_ai(context)
+        quests = await _run_groq(_generate_personalized_quests_ai, context)
 
         if not quests:
             raise HTTPException(status_code=404, detail="No quests could be generated. Check GROQ_API_KEY.")
 
         # Save quests to Firestore so validate_solution can find them by ID
-        import uuid as _uuid
-        visit_id = _uuid.uuid4().hex[:8]
+        visit_id = uuid.uuid4().hex[:8]
         saved_quests = []
+        writes = []
         for i, q in enumerate(quests):
             doc_id = f"personal_{user_id}_{latest_session_id}_{lang}_{visit_id}_{i}"
-            doc_ref = db.collection("quests").document(doc_id)
+            doc_ref = quests_col.document(doc_id)
             test_cases = q.get("testCases", [])
             quest_data = {
                 **{k: v for k, v in q.items() if k != "testCases"},
-                "testCases": json.dumps(test_cases),
+                "testCases": orjson.dumps(test_cases).decode(),
                 "userId": user_id,
                 "generatedAt": firestore.SERVER_TIMESTAMP,
                 "createdAt": firestore.SERVER_TIMESTAMP,
             }
-            try:
-                doc_ref.set(quest_data)
-            except Exception as e:
-                print(f"Error saving quest '{doc_id}': {e}")
-                raise
+            writes.append((doc_ref, quest_data, "set"))
             saved_quests.append({**q, "id": doc_id})
 
-        _rebuild_quest_lookup()
+        try:
+            await _commit_batched(writes)
+        except Exception:
+            logger.exception("Error saving personalized quests for %s", user_id)
+            raise
+
+        await _quests_written()
 
         return {
             "quests": saved_quests,
@@ -1605,7 +2362,7 @@ async def get_daily_quests(user_id: str, language: Optional[str] = None):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Daily quest error for {user_id}: {e}")
+        logger.exception("Daily quest error for %s", user_id)
         raise HTTPException(status_code=500, detail=f"Failed to get daily quests: {str(e)}")
 
 
@@ -1617,7 +2374,7 @@ async def quest_completed(req: QuestCompleteRequest):
 
     try:
         meta_ref = db.collection("student_quest_meta").document(req.userId)
-        meta_snap = meta_ref.get()
+        meta_snap = await meta_ref.get()
         current_score = 3
         total_completed = 0
         recent_perf = []
@@ -1650,7 +2407,7 @@ async def quest_completed(req: QuestCompleteRequest):
         })
         recent_perf = recent_perf[-10:]  # keep last 10
 
-        meta_ref.set({
+        await meta_ref.set({
             "difficultyScore": new_score,
             "totalQuestsCompleted": total_completed + 1,
             "recentQuestPerformance": recent_perf,
@@ -1663,7 +2420,7 @@ async def quest_completed(req: QuestCompleteRequest):
         }
 
     except Exception as e:
-        print(f"Quest complete update error: {e}")
+        logger.exception("Quest complete update error")
         return {"updated": False, "error": str(e)}
 
 
@@ -1673,31 +2430,36 @@ async def quest_completed(req: QuestCompleteRequest):
 async def seed_quests():
     """Rebuild the in-memory ALL_QUESTS lookup from Firestore."""
     try:
-        _rebuild_quest_lookup()
+        await _rebuild_quest_lookup()
 
         return {"status": "success", "quests_loaded": len(ALL_QUESTS)}
     except Exception as e:
-        print(f"Quest seed error: {e}")
+        logger.exception("Quest seed error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/admin/quests")
 async def list_quests(language: Optional[str] = None, level: Optional[str] = None):
     """List all quests, optionally filtered by language and/or level."""
     try:
-        quests_ref = db.collection("quests")
+        lang = _normalize_language(language) if language else None
+        if _quest_index_fresh():
+            # The lookup already holds every quest document; filter it in memory
+            # instead of streaming the whole collection on each admin page load
+            quests = [
+                q for q in ALL_QUESTS.values()
+                if (lang is None or q.get("language") == lang)
+                and (not level or q.get("level") == level)
+            ]
+        else:
+            quests_ref = quests_col
 
-        # Apply filters
-        if language:
-            quests_ref = quests_ref.where(filter=FieldFilter("language", "==", _normalize_language(language)))
-        if level:
-            quests_ref = quests_ref.where(filter=FieldFilter("level", "==", level))
+            # Apply filters
+            if lang:
+                quests_ref = quests_ref.where(filter=FieldFilter("language", "==", lang))
+            if level:
+                quests_ref = quests_ref.where(filter=FieldFilter("level", "==", level))
 
-        docs = quests_ref.stream()
-        quests = []
-        for doc in docs:
-            quest_data = doc.to_dict()
-            quest_data["id"] = doc.id
-            quests.append(quest_data)
+            quests = [_quest_from_doc(doc) async for doc in quests_ref.stream()]
 
         # Sort by language then level
         level_order = {"Beginner": 0, "Intermediate": 1, "Advanced": 2}
@@ -1705,7 +2467,7 @@ async def list_quests(language: Optional[str] = None, level: Optional[str] = Non
 
         return {"quests": quests, "total": len(quests)}
     except Exception as e:
-        print(f"List quests error: {e}")
+        logger.exception("List quests error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/admin/quests")
@@ -1714,9 +2476,9 @@ async def create_quest(req: QuestCreateRequest):
     try:
         lang = _normalize_language(req.language)
         doc_id = f"{lang}_{req.title.lower().replace(' ', '_')}"
-        doc_ref = db.collection("quests").document(doc_id)
+        doc_ref = quests_col.document(doc_id)
 
-        if doc_ref.get().exists:
+        if (_quest_watch is not None and doc_id in ALL_QUESTS) or (await doc_ref.get()).exists:
             raise HTTPException(status_code=409, detail="A quest with this title already exists for this language")
 
         doc_data = {
@@ -1728,23 +2490,23 @@ async def create_quest(req: QuestCreateRequest):
             "testCases": req.testCases,
             "createdAt": firestore.SERVER_TIMESTAMP,
         }
-        doc_ref.set(doc_data)
+        await doc_ref.set(doc_data)
 
-        _rebuild_quest_lookup()
+        await _quests_written()
 
         return {"status": "success", "id": doc_id, "quest": {**doc_data, "id": doc_id}}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Create quest error: {e}")
+        logger.exception("Create quest error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/admin/quests/{quest_id}")
 async def update_quest(quest_id: str, req: QuestUpdateRequest):
     """Update an existing quest in Firestore."""
     try:
-        doc_ref = db.collection("quests").document(quest_id)
-        doc = doc_ref.get()
+        doc_ref = quests_col.document(quest_id)
+        doc = await doc_ref.get()
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Quest not found")
 
@@ -1764,57 +2526,191 @@ async def update_quest(quest_id: str, req: QuestUpdateRequest):
 
         if update_data:
             update_data["updatedAt"] = firestore.SERVER_TIMESTAMP
-            doc_ref.update(update_data)
+            await doc_ref.update(update_data)
 
-        _rebuild_quest_lookup()
+        await _quests_written()
 
-        updated = doc_ref.get().to_dict()
+        updated = (await doc_ref.get()).to_dict()
         updated["id"] = quest_id
         return {"status": "success", "quest": updated}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Update quest error: {e}")
+        logger.exception("Update quest error")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/admin/quests/{quest_id}")
 async def delete_quest(quest_id: str):
     """Delete a quest from Firestore."""
     try:
-        doc_ref = db.collection("quests").document(quest_id)
-        doc = doc_ref.get()
+        doc_ref = quests_col.document(quest_id)
+        doc = await doc_ref.get()
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Quest not found")
 
-        doc_ref.delete()
-        _rebuild_quest_lookup()
+        await doc_ref.delete()
+        await _quests_written()
 
         return {"status": "success", "deleted": quest_id}
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Delete quest error: {e}")
+        logger.exception("Delete quest error")
         raise HTTPException(status_code=500, detail=str(e))
 
-def _rebuild_quest_lookup():
+def _quest_from_doc(doc) -> dict:
+    """Convert a quest document into the ALL_QUESTS entry shape."""
+    # Field names ("title", "testCases", "generatedBy", ...) are decoded into
+    # fresh strings for every document; intern them like the values below
+    data = {sys.intern(k): v for k, v in doc.to_dict().items()}
+    data["id"] = doc.id
+    if isinstance(data.get("testCases"), str):
+        try:
+            data["testCases"] = orjson.loads(data["testCases"])
+        except Exception:
+            data["testCases"] = []
+    # The same handful of language/level/test-type strings repeat across every
+    # quest; intern them so the lookup holds one copy of each
+    for key in ("language", "level", "questType"):
+        if isinstance(data.get(key), str):
+            data[key] = sys.intern(data[key])
+    if isinstance(data.get("testCases"), list):
+        data["testCases"] = [_intern_test_case(t) if isinstance(t, dict) else t for t in data["testCases"]]
+    return data
+
+def _intern_test_case(test: dict) -> dict:
+    test = {sys.intern(k): v for k, v in test.items()}
+    for key in ("type", "pattern", "function"):
+        if isinstance(test.get(key), str):
+            test[key] = sys.intern(test[key])
+    # Expected tokens ("def", "return", "for", ...) recur across most quests,
+    # and they key the scanners' pattern sets; keep one copy of each
+    expected = test.get("expected")
+    if isinstance(expected, list):
+        test["expected"] = [sys.intern(e) if isinstance(e, str) else e for e in expected]
+    return test
+
+def _json_default(value):
+    # Firestore timestamps are datetime subclasses, which orjson won't encode;
+    # isoformat() matches what FastAPI's jsonable_encoder produces
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError
+
+def _serialize_quests(by_language_level: dict) -> dict:
+    quest_json = {}
+    for key, quests in by_language_level.items():
+        try:
+            quest_json[key] = tuple(
+                (orjson.dumps(q, default=_json_default), q.get("generatedBy") == "ai")
+                for q in quests
+            )
+        except TypeError:
+            pass  # a field orjson can't encode; these are served as dicts
+    return quest_json
+
+def _build_quest_lookup(docs) -> tuple:
+    """Build ALL_QUESTS and the derived indexes from quest document snapshots.
+    Touches no globals, so it can run on the listener's thread; the result is
+    installed by _apply_quest_lookup.
+    """
+    merged = {}
+    validators = {}
+    pool = {}
+    by_language_level = {}
+    language_counts = {}
+    # One pass builds the lookup, validators, index and language counts
+    for doc in docs:
+        quest = merged[doc.id] = _quest_from_doc(doc)
+        validators[doc.id] = _compile_validators(quest, pool)
+        by_language_level.setdefault((quest.get("language"), quest.get("level")), []).append(quest)
+        lang = quest.get("language", "python")
+        language_counts[lang] = language_counts.get(lang, 0) + 1
+
+    languages_blob = orjson.dumps(_quest_languages_payload(language_counts))
+    return (
+        merged,
+        validators,
+        pool,
+        {key: tuple(quests) for key, quests in by_language_level.items()},
+        _serialize_quests(by_language_level),
+        languages_blob,
+        gzip.compress(languages_blob) if len(languages_blob) >= GZIP_MIN_SIZE else b"",
+        # Weak ETag: the same tag covers both the plain and gzip representations
+        f'W/"{hashlib.blake2b(languages_blob, digest_size=8).hexdigest()}"',
+    )
+
+def _apply_quest_lookup(lookup: tuple):
+    """Install a _build_quest_lookup result. Must run on the event loop: the
+    request handlers read these globals, and _validation_cache isn't thread-safe.
+    """
+    global ALL_QUESTS, QUESTS_BY_LANGUAGE_LEVEL, QUEST_JSON_BY_LANGUAGE_LEVEL
+    global QUEST_VALIDATORS, _validator_pool, _quest_index_built_at
+    global _quest_languages_blob, _quest_languages_blob_gz, _quest_languages_etag
+    (ALL_QUESTS, QUEST_VALIDATORS, _validator_pool, QUESTS_BY_LANGUAGE_LEVEL,
+     QUEST_JSON_BY_LANGUAGE_LEVEL, _quest_languages_blob, _quest_languages_blob_gz,
+     _quest_languages_etag) = lookup
+    _validation_cache.clear()
+    _quest_index_built_at = time.monotonic()
+
+async def _rebuild_quest_lookup():
     """Rebuild the ALL_QUESTS lookup dict from Firestore."""
-    global ALL_QUESTS
+    # Also called without a listener after quest writes, so drop cached queries too
+    _quest_query_cache.clear()
     try:
-        merged = {}
-        docs = db.collection("quests").stream()
-        for doc in docs:
-            data = doc.to_dict()
-            data["id"] = doc.id
-            if isinstance(data.get("testCases"), str):
-                try:
-                    data["testCases"] = json.loads(data["testCases"])
-                except Exception:
-                    data["testCases"] = []
-            merged[doc.id] = data
-
-        ALL_QUESTS = merged
-    except Exception as e:
-        print(f"Rebuild quest lookup error: {e}")
+        _apply_quest_lookup(_build_quest_lookup([doc async for doc in quests_col.stream()]))
+    except Exception:
+        logger.exception("Rebuild quest lookup error")
+
+async def _quests_written():
+    """Bring this worker's quest lookup up to date after it wrote quests."""
+    _quest_query_cache.clear()
+    _missing_quest_ids.clear()  # a new quest may reuse an id looked up before
+    # The listener delivers the write as a snapshot and rebuilds from it; only
+    # without one does the collection need reading again here. Quest ids that
+    # aren't indexed yet are still found by _ensure_quest_loaded meanwhile.
+    if _quest_watch is None:
+        await _rebuild_quest_lookup()
+
+def _apply_quest_snapshot(lookup: tuple):
+    _apply_quest_lookup(lookup)
+    _quest_snapshot_ready.set()
+
+def _on_quests_snapshot(col_snapshot, changes, read_time):
+    """Firestore listener callback (runs on the listener's thread).
+    The lookup is built here, off the loop, and handed to the loop to install.
+    """
+    try:
+        lookup = _build_quest_lookup(col_snapshot)
+        _quest_loop.call_soon_threadsafe(_apply_quest_snapshot, lookup)
+    except Exception:
+        logger.exception("Quest listener error")
+
+def _quest_index_fresh() -> bool:
+    """Whether the in-memory quest indexes can be served without querying Firestore."""
+    return _quest_watch is not None or time.monotonic() - _quest_index_built_at < QUEST_INDEX_MAX_AGE
+
+async def _ensure_quest_loaded(quest_id):
+    """Fetch a single quest into ALL_QUESTS if this worker hasn't seen it yet.
+    ALL_QUESTS is per process, so a quest created through another Gunicorn
+    worker is only known here after a lookup.
+    """
+    if quest_id in ALL_QUESTS or quest_id in _missing_quest_ids:
+        return
+    try:
+        doc = await quests_col.document(quest_id).get()
+        if doc.exists:
+            # A rebuild may have swapped the tables during the read; take the
+            # current set once so the quest lands in matching lookup, validator
+            # table and pool
+            quests, validators, pool = ALL_QUESTS, QUEST_VALIDATORS, _validator_pool
+            quest = quests[doc.id] = _quest_from_doc(doc)
+            validators[doc.id] = _compile_validators(quest, pool)
+        else:
+            # Don't re-read a bad id on every resubmission
+            _missing_quest_ids[quest_id] = True
+    except Exception:
+        logger.exception("Quest lookup error for %s", quest_id)
 
 # --- AI Detection Endpoint ---
 
@@ -1825,8 +2721,8 @@ async def detect_ai(session_id: str):
     Reads session data + behavioral signals from Firestore and returns full signal breakdown.
     """
     try:
-        doc_ref = db.collection("sessions").document(session_id)
-        doc = doc_ref.get()
+        doc_ref = sessions_col.document(session_id)
+        doc = await doc_ref.get()
         if not doc.exists:
             raise HTTPException(status_code=404, detail="Session not found")
 
@@ -1844,39 +2740,77 @@ async def detect_ai(session_id: str):
         result = AIDetectionEngine.analyze(detection_input)
 
         # Store result back in session
-        doc_ref.update({"aiDetection": result})
+        await doc_ref.update({"aiDetection": result})
 
         return result
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"AI Detection error: {e}")
+        logger.exception("AI Detection error")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # --- Code Analysis ---
 
+# Fire-and-forget tasks; referenced here so they aren't garbage collected mid-flight
+_background_tasks = set()
+
+def _spawn_background(coro, description: str):
+    """Run coro without awaiting it, logging (not raising) any failure."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+
+    def _done(t):
+        _background_tasks.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            logger.error("%s failed", description, exc_info=t.exception())
+    task.add_done_callback(_done)
+    return task
+
+_TOKEN_RE = re.compile(r"\S+")
+
+def _token_count(code: str) -> int:
+    """Number of whitespace-separated tokens, i.e. len(code.split()) without
+    materialising the list of substrings for large submissions."""
+    return sum(1 for _ in _TOKEN_RE.finditer(code))
+
+async def _classify_submission(code: str, language: str) -> tuple:
+    """(skill level, confidence %) for submitted code."""
+    # Groq as primary classifier, CodeBERT as fallback
+    groq_label, groq_conf = await _run_groq(_classify_code_groq, code, language)
+    if groq_label:
+        return groq_label, groq_conf * 100
+    if await _loaded_model():
+        # One forward pass; the label is just the most probable class
+        probs = await model_batcher.predict_proba(code)
+        return _label_from_probs(probs)
+    if "class " in code or "lambda" in code:
+        return "Advanced", 0.0
+    if "def " in code or "import " in code:
+        return "Intermediate", 0.0
+    return "Beginner", 0.0
+
+async def _validate_submission(code: str, quest_id) -> dict:
+    # Validate solution if questId is provided
+    if not quest_id:
+        return {"passed": True, "tests_passed": 0, "tests_total": 0, "message": "No validation", "details": []}
+    # Quests are keyed by their document id, so numeric ids are looked up as
+    # that string instead of missing the index and re-reading Firestore
+    if isinstance(quest_id, (int, float)):
+        quest_id = str(int(quest_id))
+    await _ensure_quest_loaded(quest_id)
+    return await validate_solution(code, quest_id)
+
 @app.post("/analyze")
 async def analyze_code(session: CodeSession):
     try:
-        skill_level = "Beginner"
-        confidence = 0.0
-
-        # Groq as primary classifier, CodeBERT as fallback
-        groq_label, groq_conf = _classify_code_groq(session.code, session.language or "python")
-        if groq_label:
-            skill_level = groq_label
-            confidence = groq_conf * 100
-        elif ai_model:
-            skill_level = ai_model.predict([session.code])[0]
-            probs = ai_model.predict_proba([session.code])[0]
-            confidence = float(max(probs) * 100)
-        else:
-            if "class " in session.code or "lambda" in session.code:
-                skill_level = "Advanced"
-            elif "def " in session.code or "import " in session.code:
-                skill_level = "Intermediate"
+        # Classification (Groq/CodeBERT) and validation (sandbox) don't depend on
+        # each other, so run them side by side
+        (skill_level, confidence), validation = await asyncio.gather(
+            _classify_submission(session.code, session.language or "python"),
+            _validate_submission(session.code, session.questId),
+        )
 
         bs = session.behavioralSignals or {}
         detection_input = {
@@ -1891,11 +2825,6 @@ async def analyze_code(session: CodeSession):
         detection_result = AIDetectionEngine.analyze(detection_input)
         ai_probability = detection_result["aiLikelihoodScore"]
 
-        # Validate solution if questId is provided
-        validation = {"passed": True, "tests_passed": 0, "tests_total": 0, "message": "No validation", "details": []}
-        if session.questId:
-            validation = validate_solution(session.code, session.questId)
-
         doc_data = {
             "userId": session.userId,
             "email": session.email,
@@ -1908,7 +2837,7 @@ async def analyze_code(session: CodeSession):
             "stats": {
                 "duration": session.duration,
                 "keystrokes": session.keystrokes,
-                "complexity": len(session.code.split()),
+                "complexity": _token_count(session.code),
                 "skillLevel": skill_level,
                 "confidence": confidence,
                 "aiProbability": ai_probability,
@@ -1924,9 +2853,12 @@ async def analyze_code(session: CodeSession):
             }
         }
 
-        db.collection("sessions").add(doc_data)
+        # The response doesn't depend on the write, so don't make the client wait for it
+        _spawn_background(sessions_col.add(doc_data), "Saving analyzed session")
 
-        return {
+        # Only plain str/int/float/list/dict values here, so hand orjson the
+        # dict directly instead of a jsonable_encoder pass over it first
+        return ORJSONResponse({
             "status": "success",
             "stats": {
                 "skillLevel": skill_level,
@@ -1944,12 +2876,38 @@ async def analyze_code(session: CodeSession):
                     "recommendation": detection_result["recommendation"]
                 }
             }
-        }
+        })
+
+    except Exception as e:
+        logger.exception("Server Error")
+        raise HTTPException(status_code=500, detail=str(e))
 
+
+# Upper bound on snippets per /classify/batch call, to keep one request from
+# monopolising the model
+CLASSIFY_BATCH_MAX = 64
+
+@app.post("/classify/batch")
+async def classify_batch(req: ClassifyBatchRequest):
+    """Classify several code snippets with CodeBERT in a single forward pass."""
+    model = await _loaded_model()
+    if not model:
+        raise HTTPException(status_code=503, detail="AI model not loaded")
+    if len(req.codes) > CLASSIFY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CLASSIFY_BATCH_MAX} snippets per request")
+
+    try:
+        classified = await _run_model(model.classify, req.codes)
     except Exception as e:
-        print(f"Server Error: {e}")
+        logger.exception("Batch classify error")
         raise HTTPException(status_code=500, detail=str(e))
 
+    results = [
+        {"skillLevel": skill_level, "confidence": confidence}
+        for skill_level, confidence in classified
+    ]
+    return ORJSONResponse({"results": results})
+
 
 if __name__ == "__main__":
     import uvicorn
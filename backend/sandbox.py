@@ -0,0 +1,102 @@
+"""Runs submitted quest code for the validator, in worker processes.
+
+main.py keeps a ProcessPoolExecutor of these workers (see _run_in_sandbox) so
+user code never executes inside the API process. Kept free of heavy imports
+since every worker is a fresh interpreter.
+"""
+
+import contextlib
+import io
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows; run without limits
+
+# CPU seconds one submission may use; exceeding it kills the worker (SIGXCPU)
+CPU_SECONDS = 2
+# Address space cap per worker
+MEMORY_BYTES = 512 * 1024 * 1024
+
+
+def init_worker():
+    """Pool initializer: cap the worker's memory."""
+    if resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (MEMORY_BYTES, MEMORY_BYTES))
+
+
+def _limit_cpu():
+    # RLIMIT_CPU counts the process's whole lifetime, so move the soft limit
+    # to CPU_SECONDS past what this worker has used so far
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + CPU_SECONDS
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _find_function(namespace: dict, func_name: str):
+    # Try to find function with various naming conventions
+    for name in [func_name, func_name.replace("_", ""), func_name.lower()]:
+        if name in namespace and callable(namespace[name]):
+            return namespace[name]
+    # Try to find any function that could be it
+    for name, val in namespace.items():
+        if callable(val) and not name.startswith("_"):
+            return val
+    return None
+
+
+def _run_function_test(namespace: dict, resolved: dict, func_name, inputs, expected):
+    try:
+        # Several test cases usually target the same function; look it up once
+        if func_name not in resolved:
+            resolved[func_name] = _find_function(namespace, func_name)
+        func = resolved[func_name]
+        if not func:
+            return f"Function '{func_name}' not found"
+        for inp, exp in zip(inputs, expected):
+            result = func(*inp) if isinstance(inp, list) else func(inp)
+            if result != exp:
+                return f"Function test failed: {func_name}({inp}) returned {result}, expected {exp}"
+        return None
+    except (Exception, SystemExit) as e:
+        return f"Function test error: {str(e)[:50]}"
+
+
+def run_tests(code: str, specs: list) -> list:
+    """Execute code once and evaluate every exec-based test case against it.
+
+    specs holds ("output", expected) and ("function", name, inputs, expected)
+    tuples. Returns one entry per spec: None if it passed, else the failure
+    message.
+    """
+    _limit_cpu()
+    stdout = io.StringIO()
+    namespace = {"__builtins__": __builtins__}
+    resolved = {}
+    error = None
+    with contextlib.redirect_stdout(stdout):
+        try:
+            # Compiled and executed once for all of the quest's test cases
+            exec(compile(code, "<submission>", "exec"), namespace)
+        except (Exception, SystemExit) as e:
+            error = e
+        output = stdout.getvalue()
+
+        results = []
+        for spec in specs:
+            if spec[0] == "output":
+                if error is not None:
+                    results.append(f"Execution error: {str(error)[:50]}")
+                    continue
+                missing = [e for e in spec[1] if e not in output]
+                results.append(f"Output missing: {missing}" if missing else None)
+            elif error is not None:
+                results.append(f"Function test error: {str(error)[:50]}")
+            else:
+                results.append(_run_function_test(namespace, resolved, *spec[1:]))
+    return results
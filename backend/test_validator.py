@@ -0,0 +1,37 @@
+"""Tests for the compiled quest validators in main.py.
+
+Run from backend/: python -m pytest test_validator.py
+"""
+
+import pytest
+
+import main
+
+
+def _check(test: dict, code: str):
+    return main._compile_test(test, "python")(code, frozenset(), ())
+
+
+@pytest.mark.parametrize("threshold_key", ["min_count", "min"])
+def test_code_count_threshold(threshold_key):
+    test = {"type": "code_count", "pattern": "<li>", threshold_key: 3}
+    assert _check(test, "<li>a</li><li>b</li><li>c</li>") is None
+    assert _check(test, "<li>a</li><li>b</li>") == "Pattern '<li>' found 2 times, need at least 3"
+
+
+def test_code_count_min_count_wins_over_min():
+    test = {"type": "code_count", "pattern": "x", "min_count": 1, "min": 5}
+    assert _check(test, "x") is None
+
+
+def test_code_count_numeric_string_threshold():
+    test = {"type": "code_count", "pattern": "for", "min": "2"}
+    assert _check(test, "for for") is None
+    assert _check(test, "for") == "Pattern 'for' found 1 times, need at least 2"
+
+
+@pytest.mark.parametrize("bad", ["three", None, [3], {}])
+def test_code_count_bad_threshold_defaults_to_one(bad):
+    test = {"type": "code_count", "pattern": "for", "min": bad}
+    assert _check(test, "for") is None
+    assert _check(test, "while") == "Pattern 'for' found 0 times, need at least 1"